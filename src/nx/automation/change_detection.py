@@ -0,0 +1,103 @@
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from . import image_processing, regions
+from .frame_grabber import Frame
+from .image_processing import Size, TopLeftCoords
+
+# Regions are compared at this fraction of their size, which also averages out capture noise
+DOWNSAMPLE_FACTOR = 0.25
+# A downsampled pixel has to change by more than this for its region to count as changed
+DEFAULT_THRESHOLD = 16
+# A region that changed is reported once more after it has stayed within the threshold for this many frames
+DEFAULT_SETTLE_FRAMES = 3
+
+
+class ChangeDetector:
+    """
+    Tells which of a set of screen regions changed since they were last reported as changed.
+
+    Regions are compared as downsampled grayscale images, so checking a frame is cheap enough to do for every
+    frame. A region is compared against how it looked when it last changed rather than against the previous frame,
+    so slow fades still count as a change eventually. Every region counts as changed on the first frame.
+
+    A region caught mid-transition, e.g. while text is still fading in, may settle on its final look without
+    changing by more than the threshold again. So once a changed region has stayed put for settle_frames frames,
+    it is reported as changed one more time, for callers to read it again.
+    """
+
+    def __init__(
+        self,
+        watched: Sequence[Tuple[TopLeftCoords, Size]],
+        threshold: int = DEFAULT_THRESHOLD,
+        settle_frames: int = DEFAULT_SETTLE_FRAMES,
+    ):
+        self.regions = [regions.region(top_left, size) for top_left, size in watched]
+        self.threshold = threshold
+        self.settle_frames = settle_frames
+        self._references: List[Optional[np.ndarray]] = [None] * len(self.regions)
+        # Frames each region has stayed put since it last changed, None once it was reported as settled
+        self._stable_frames: List[Optional[int]] = [None] * len(self.regions)
+
+    def _downsample(self, image: np.ndarray, region: regions.Region) -> np.ndarray:
+        roi = region.crop(image)
+        small_size = (max(1, round(roi.shape[1] * DOWNSAMPLE_FACTOR)), max(1, round(roi.shape[0] * DOWNSAMPLE_FACTOR)))
+        small = cv.resize(roi, small_size, interpolation=cv.INTER_AREA)
+        return cv.cvtColor(small, cv.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def changed(self, image: np.ndarray) -> List[bool]:
+        result = []
+        for index, region in enumerate(self.regions):
+            small = self._downsample(image, region)
+            reference = self._references[index]
+            if reference is None or reference.shape != small.shape:
+                is_changed = True
+            else:
+                is_changed = bool(cv.absdiff(small, reference).max() > self.threshold)
+            if is_changed:
+                self._references[index] = small
+                self._stable_frames[index] = 0
+            else:
+                stable_frames = self._stable_frames[index]
+                if stable_frames is not None:
+                    stable_frames += 1
+                    if stable_frames >= self.settle_frames:
+                        is_changed = True
+                        self._references[index] = small
+                        stable_frames = None
+                    self._stable_frames[index] = stable_frames
+            result.append(is_changed)
+        return result
+
+    def copy_regions(self, image: np.ndarray) -> np.ndarray:
+        """The watched regions of image, see regions.copy_regions."""
+        return regions.copy_regions(image, self.regions)
+
+    def reset(self) -> None:
+        self._references = [None] * len(self.regions)
+        self._stable_frames = [None] * len(self.regions)
+
+
+def wait_for_change(
+    detector: ChangeDetector, after_seq: int = 0, timeout: Optional[float] = None, copy: bool = False
+) -> Tuple[Frame, List[bool]]:
+    """
+    Wait for the first frame after after_seq in which any of the detector's regions changed. With copy, the frame's
+    image is detector.copy_regions() of it, taken right away, for callers that read the regions later.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        frame = image_processing.wait_for_frame(after_seq, timeout=remaining)
+        changed = detector.changed(frame.image)
+        if any(changed):
+            if copy:
+                frame = frame._replace(image=detector.copy_regions(frame.image))
+            return frame, changed
+        after_seq = frame.seq
+        # Frames keep arriving while nothing changes, so the frame source alone never times out
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError("No change within timeout")
@@ -0,0 +1,211 @@
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .frame_grabber import Frame
+
+DEFAULT_FRAME_BUS_NAME = "nx-frames"
+# Enough that a frame is not overwritten for a few frame intervals after it was published
+DEFAULT_NUM_SLOTS = 8
+# How often readers check for a new frame while waiting for one
+POLL_INTERVAL_S = 0.002
+
+MAGIC = 0x4E58465242555331  # "NXFRBUS1"
+HEADER_FIELDS = 8
+# Indexes into the int64 header
+H_MAGIC, H_HEIGHT, H_WIDTH, H_CHANNELS, H_NUM_SLOTS, H_LATEST_SEQ, H_CLOSED, H_BGR2RGB = range(HEADER_FIELDS)
+# Slot sequence number while the writer is filling it
+WRITING = -1
+
+
+def _layout(num_slots: int) -> Tuple[int, int, int]:
+    """Offsets of the slot sequence numbers, slot timestamps and slot images in the shared memory."""
+    seq_offset = HEADER_FIELDS * 8
+    time_offset = seq_offset + num_slots * 8
+    data_offset = time_offset + num_slots * 8
+    return seq_offset, time_offset, data_offset
+
+
+class _FrameBusMapping:
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if self.header[H_MAGIC] != MAGIC:
+            raise ValueError(f"{shm.name} is not a frame bus")
+        self.shape = (int(self.header[H_HEIGHT]), int(self.header[H_WIDTH]), int(self.header[H_CHANNELS]))
+        self.num_slots = int(self.header[H_NUM_SLOTS])
+        seq_offset, time_offset, data_offset = _layout(self.num_slots)
+        self.slot_seqs = np.ndarray((self.num_slots,), dtype=np.int64, buffer=shm.buf, offset=seq_offset)
+        self.slot_times = np.ndarray((self.num_slots,), dtype=np.float64, buffer=shm.buf, offset=time_offset)
+        self.slots = np.ndarray((self.num_slots, *self.shape), dtype=np.uint8, buffer=shm.buf, offset=data_offset)
+
+    def close(self) -> None:
+        # The arrays must not outlive the mapping
+        del self.header, self.slot_seqs, self.slot_times, self.slots
+        self.shm.close()
+
+
+class FrameBusWriter:
+    """
+    Publishes frames into a ring of slots in shared memory, so that any number of processes can read them.
+
+    Each slot has a sequence number that is WRITING while the slot is being filled and the frame's number once it
+    is complete. The latest complete frame number is published in the header last.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, int, int],
+        name: str = DEFAULT_FRAME_BUS_NAME,
+        num_slots: int = DEFAULT_NUM_SLOTS,
+        first_seq: int = 1,
+        bgr2rgb: bool = False,
+    ):
+        _, _, data_offset = _layout(num_slots)
+        size = data_offset + num_slots * shape[0] * shape[1] * shape[2]
+        try:
+            # Left over from a writer that didn't exit cleanly, readers may still be attached to it
+            stale: Optional[shared_memory.SharedMemory] = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            stale = None
+        stale_header = None
+        if stale is not None:
+            if stale.size >= HEADER_FIELDS * 8:
+                stale_header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=stale.buf)
+                if stale_header[H_MAGIC] == MAGIC:
+                    # Continue its numbering, readers wait for a frame newer than the last one they read from it
+                    first_seq = max(first_seq, int(stale_header[H_LATEST_SEQ]) + 1)
+                else:
+                    stale_header = None
+            stale.unlink()
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[H_HEIGHT], header[H_WIDTH], header[H_CHANNELS] = shape
+        header[H_NUM_SLOTS] = num_slots
+        # Whether the capture device delivers frames that capture(convert=True) has to convert
+        header[H_BGR2RGB] = bgr2rgb
+        np.ndarray((num_slots,), dtype=np.int64, buffer=shm.buf, offset=_layout(num_slots)[0])[:] = WRITING
+        # Written last, readers refuse to attach before it is set
+        header[H_MAGIC] = MAGIC
+        del header
+        self.mapping = _FrameBusMapping(shm)
+        if stale is not None:
+            if stale_header is not None:
+                # Only now that the replacement exists, so that readers can attach to it straight away
+                stale_header[H_CLOSED] = 1
+                del stale_header
+            stale.close()
+        # A writer that replaces another one continues its numbering, so readers don't wait for an old number again
+        self.seq = first_seq - 1
+
+    @property
+    def name(self) -> str:
+        return self.mapping.shm.name
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.mapping.shape
+
+    def publish(self, image: np.ndarray) -> int:
+        mapping = self.mapping
+        seq = self.seq + 1
+        slot = seq % mapping.num_slots
+        mapping.slot_seqs[slot] = WRITING
+        mapping.slots[slot] = image
+        mapping.slot_times[slot] = time.monotonic()
+        mapping.slot_seqs[slot] = seq
+        mapping.header[H_LATEST_SEQ] = seq
+        self.seq = seq
+        return seq
+
+    def close(self) -> None:
+        # Tells readers to attach to whatever bus replaces this one
+        self.mapping.header[H_CLOSED] = 1
+        shm = self.mapping.shm
+        self.mapping.close()
+        shm.unlink()
+
+    def __enter__(self) -> "FrameBusWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameBusReader:
+    """
+    Reads frames published by a FrameBusWriter in another process, with the same interface as FrameGrabber.
+
+    The image of a frame is a view into the shared memory, not a copy. It stays valid until the writer has
+    published num_slots more frames; use is_valid() after working on a frame, or copy it, if that may take longer.
+    """
+
+    def __init__(self, name: str = DEFAULT_FRAME_BUS_NAME):
+        self.name = name
+        self.mapping = self._attach()
+
+    def _attach(self) -> _FrameBusMapping:
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(self.name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(self.name)
+            # Otherwise the resource tracker unlinks the writer's shared memory when this process exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        try:
+            return _FrameBusMapping(shm)
+        except ValueError:
+            shm.close()
+            raise
+
+    def _current_mapping(self) -> _FrameBusMapping:
+        if self.mapping.header[H_CLOSED]:
+            # The writer was restarted, e.g. because the resolution changed
+            old_mapping = self.mapping
+            self.mapping = self._attach()
+            try:
+                old_mapping.close()
+            except BufferError:
+                # Somebody still holds a frame from it, the memory is released along with the last one
+                pass
+        return self.mapping
+
+    def _read(self, seq: int) -> Optional[Frame]:
+        mapping = self.mapping
+        slot = seq % mapping.num_slots
+        timestamp = float(mapping.slot_times[slot])
+        if mapping.slot_seqs[slot] != seq:
+            return None
+        return Frame(mapping.slots[slot], seq, timestamp)
+
+    @property
+    def bgr2rgb(self) -> bool:
+        return bool(self.mapping.header[H_BGR2RGB])
+
+    def is_valid(self, frame: Frame) -> bool:
+        """Whether the frame's image has not been overwritten by a newer frame yet."""
+        return self.mapping.slot_seqs[frame.seq % self.mapping.num_slots] == frame.seq
+
+    def latest(self, timeout: Optional[float] = None) -> Frame:
+        return self.wait_for_frame(timeout=timeout)
+
+    def wait_for_frame(
+        self, after_seq: int = 0, newer_than: Optional[float] = None, timeout: Optional[float] = None
+    ) -> Frame:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mapping = self._current_mapping()
+            seq = int(mapping.header[H_LATEST_SEQ])
+            if seq > after_seq:
+                frame = self._read(seq)
+                if frame is not None and (newer_than is None or frame.timestamp > newer_than):
+                    return frame
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("No new frame within timeout")
+            time.sleep(POLL_INTERVAL_S)
+
+    def close(self) -> None:
+        self.mapping.close()
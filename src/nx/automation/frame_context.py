@@ -0,0 +1,81 @@
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import cv2 as cv
+import numpy as np
+
+from . import regions
+
+_buffers = threading.local()
+
+
+class FrameContext:
+    """
+    One frame together with the preprocessing that every region read from it can share.
+
+    The grayscale frame is only computed when a region first needs it, once, and regions are views into it.
+    A context can be used by several threads at once.
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self._gray: Optional[np.ndarray] = None
+        self._gray_lock = threading.Lock()
+
+    @property
+    def gray(self) -> np.ndarray:
+        gray = self._gray
+        if gray is None:
+            with self._gray_lock:
+                if self._gray is None:
+                    self._gray = cv.cvtColor(self.image, cv.COLOR_BGR2GRAY) if self.image.ndim == 3 else self.image
+                gray = self._gray
+        return gray
+
+    def roi(self, region: regions.Region) -> np.ndarray:
+        return region.crop(self.image)
+
+    def gray_roi(self, region: regions.Region) -> np.ndarray:
+        return region.crop(self.gray)
+
+
+def frame_context(image: Union[np.ndarray, FrameContext]) -> FrameContext:
+    return image if isinstance(image, FrameContext) else FrameContext(image)
+
+
+def gray_roi(image: Union[np.ndarray, FrameContext], region: regions.Region) -> np.ndarray:
+    """
+    A region of a frame in grayscale. A shared FrameContext converts the whole frame once for all of its regions,
+    a plain image only has the region converted since nothing else will read it.
+    """
+    if isinstance(image, FrameContext):
+        return image.gray_roi(region)
+    roi = region.crop(image)
+    return cv.cvtColor(roi, cv.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+
+
+def _bordered_buffer(shape: Tuple[int, int], border_size: int) -> np.ndarray:
+    buffers: Dict[Tuple[int, int, int], np.ndarray] = getattr(_buffers, "bordered", None)
+    if buffers is None:
+        buffers = _buffers.bordered = {}
+    key = (shape[0], shape[1], border_size)
+    buffer = buffers.get(key)
+    if buffer is None:
+        # Only the inside is ever written, so the border stays white
+        buffer = np.full((shape[0] + 2 * border_size, shape[1] + 2 * border_size), 255, dtype=np.uint8)
+        buffers[key] = buffer
+    return buffer
+
+
+def threshold_with_border(gray_roi: np.ndarray, invert: bool, border_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Otsu threshold gray_roi straight into the middle of a white bordered buffer that the calling thread reuses.
+    Returns the thresholded region and the whole bordered image, which are overwritten by the thread's next call
+    for a region of the same size.
+    """
+    buffer = _bordered_buffer(gray_roi.shape, border_size)
+    inside = buffer[border_size : border_size + gray_roi.shape[0], border_size : border_size + gray_roi.shape[1]]
+    # Inverting while thresholding gives the same result as thresholding and then inverting
+    threshold_type = cv.THRESH_BINARY_INV if invert else cv.THRESH_BINARY
+    cv.threshold(gray_roi, 30, 255, threshold_type | cv.THRESH_OTSU, dst=inside)
+    return inside, buffer
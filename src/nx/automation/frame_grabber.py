@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+# Wait this long before reading again when the capture device fails, so a missing device doesn't spin
+RETRY_INTERVAL_S = 1.0
+# FrameReader reads no more often than the game renders frames
+FRAME_INTERVAL_S = 1 / 60
+
+
+class Frame(NamedTuple):
+    image: np.ndarray
+    # Increases by one for every frame read from the device
+    seq: int
+    # time.monotonic() when the frame finished being read
+    timestamp: float
+
+
+class FrameGrabber:
+    """
+    Reads frames from a capture device continuously on a background thread and keeps only the latest one.
+
+    Reading as fast as the device delivers frames keeps its internal buffers drained, so the latest frame is never
+    several frames stale, and callers get it without waiting for a read and decode. Every read returns a new
+    image, so a frame stays valid for as long as a caller holds on to it.
+    """
+
+    def __init__(self, read_frame: Callable[[], np.ndarray], name: str = "frame-grabber"):
+        self.read_frame = read_frame
+        self.name = name
+        self._latest: Optional[Frame] = None
+        self._frame_cv = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "FrameGrabber":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        seq = 0
+        while not self._stop.is_set():
+            try:
+                image = self.read_frame()
+                if image is None:
+                    raise RuntimeError("Capture device returned no frame")
+            except Exception as e:
+                print(f"Failed to read frame: {e!r}")
+                self._stop.wait(RETRY_INTERVAL_S)
+                continue
+
+            seq += 1
+            frame = Frame(image, seq, time.monotonic())
+            with self._frame_cv:
+                self._latest = frame
+                self._frame_cv.notify_all()
+
+    def latest(self, timeout: Optional[float] = None) -> Frame:
+        """The most recent frame, only waits if no frame has been read yet."""
+        return self.wait_for_frame(timeout=timeout)
+
+    def wait_for_frame(
+        self, after_seq: int = 0, newer_than: Optional[float] = None, timeout: Optional[float] = None
+    ) -> Frame:
+        """
+        The most recent frame if it is newer than frame number after_seq and was captured after the monotonic time
+        newer_than, otherwise wait for the next one that is.
+        """
+        self.start()
+
+        def is_new_enough() -> bool:
+            frame = self._latest
+            return frame is not None and frame.seq > after_seq and (newer_than is None or frame.timestamp > newer_than)
+
+        with self._frame_cv:
+            if not self._frame_cv.wait_for(is_new_enough, timeout):
+                raise TimeoutError("No new frame within timeout")
+            return self._latest
+
+
+class FrameReader:
+    """
+    Reads a frame whenever one is asked for, with the same interface as FrameGrabber.
+
+    For capture methods like PrintWindow that take a screenshot rather than drain a device's buffers, so there is
+    nothing to gain from reading continuously on a thread, which would only keep a core busy. Reads are spaced at
+    least min_interval apart, so that callers polling for a change don't either.
+    """
+
+    def __init__(self, read_frame: Callable[[], np.ndarray], min_interval: float = FRAME_INTERVAL_S):
+        self.read_frame = read_frame
+        self.min_interval = min_interval
+        self._seq = 0
+        self._last_read = 0.0
+        self._lock = threading.Lock()
+
+    def latest(self, timeout: Optional[float] = None) -> Frame:
+        return self.wait_for_frame(timeout=timeout)
+
+    def wait_for_frame(
+        self, after_seq: int = 0, newer_than: Optional[float] = None, timeout: Optional[float] = None
+    ) -> Frame:
+        """A newly read frame, which is always newer than any frame this reader returned before."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            next_read = max(self._last_read + self.min_interval, newer_than or 0.0)
+            while True:
+                now = time.monotonic()
+                if deadline is not None and next_read > deadline:
+                    raise TimeoutError("No new frame within timeout")
+                if next_read > now:
+                    time.sleep(next_read - now)
+                self._last_read = time.monotonic()
+                image = self.read_frame()
+                if image is not None:
+                    # Every read is a new frame, so it is numbered after anything a caller has seen
+                    self._seq = max(self._seq, after_seq) + 1
+                    return Frame(image, self._seq, time.monotonic())
+                print("Failed to read frame: capture device returned no frame")
+                next_read = self._last_read + RETRY_INTERVAL_S
@@ -0,0 +1,134 @@
+from typing import List, NamedTuple, Optional, Sequence
+
+import cv2 as cv
+import numpy as np
+
+# Glyphs are compared as squares of this many pixels a side
+DEFAULT_GLYPH_SIZE = 16
+# Smaller components are noise
+MIN_COMPONENT_AREA = 2
+# A gap between glyphs wider than this fraction of the line height is read as a space
+SPACE_GAP = 0.5
+# How different a glyph may be from the closest glyph in the atlas, 0 is identical and 1 shares no pixels
+DEFAULT_MAX_DISTANCE = 0.2
+
+
+class GlyphBox(NamedTuple):
+    left: int
+    top: int
+    width: int
+    height: int
+    # The glyph's pixels within the box, more than one component for glyphs like "i" or ":"
+    mask: np.ndarray
+
+
+def segment(bw_image: np.ndarray, min_area: int = MIN_COMPONENT_AREA) -> List[GlyphBox]:
+    """Glyphs of a thresholded image with white text, left to right. Components that overlap horizontally are one."""
+    count, labels, stats, _ = cv.connectedComponentsWithStats(bw_image, connectivity=8)
+    # Plain ints are much faster to work with than NumPy scalars for a handful of components
+    rows = stats.tolist()
+    components = sorted(
+        (index for index in range(1, count) if rows[index][cv.CC_STAT_AREA] >= min_area),
+        key=lambda index: rows[index][cv.CC_STAT_LEFT],
+    )
+
+    groups: List[List[int]] = []
+    group_right = 0
+    for index in components:
+        left, _, width, _, _ = rows[index]
+        if groups and left < group_right:
+            groups[-1].append(index)
+            group_right = max(group_right, left + width)
+        else:
+            groups.append([index])
+            group_right = left + width
+
+    boxes = []
+    for group in groups:
+        left = min(rows[index][cv.CC_STAT_LEFT] for index in group)
+        top = min(rows[index][cv.CC_STAT_TOP] for index in group)
+        right = max(rows[index][cv.CC_STAT_LEFT] + rows[index][cv.CC_STAT_WIDTH] for index in group)
+        bottom = max(rows[index][cv.CC_STAT_TOP] + rows[index][cv.CC_STAT_HEIGHT] for index in group)
+        box_labels = labels[top:bottom, left:right]
+        mask = box_labels == group[0] if len(group) == 1 else np.isin(box_labels, group)
+        boxes.append(GlyphBox(left, top, right - left, bottom - top, mask))
+    return boxes
+
+
+class GlyphRecognizer:
+    """
+    Reads text in a fixed bitmap font, like the game's HP and zenny counters, by comparing every glyph with the
+    glyphs in an atlas learned from sample frames. Much faster than tesseract, and the same pixels always read
+    the same.
+
+    Glyphs are scaled by the height of the region rather than their own, and keep their place in it, so that
+    glyphs that only differ in size or position like "-" and "_" stay apart. A recognizer should therefore learn
+    from and read regions of the same height, like the same counter on different frames.
+    """
+
+    def __init__(self, size: int = DEFAULT_GLYPH_SIZE, max_distance: float = DEFAULT_MAX_DISTANCE):
+        self.size = size
+        self.max_distance = max_distance
+        self.glyphs = np.zeros((0, size * size), dtype=np.float32)
+        self.labels: List[str] = []
+
+    def _features(self, boxes: Sequence[GlyphBox], region_height: int) -> np.ndarray:
+        size = self.size
+        features = np.zeros((len(boxes), size, size), dtype=np.float32)
+        scale = size / region_height
+        for feature, box in zip(features, boxes):
+            width = min(size, max(1, round(box.width * scale)))
+            height = min(size, max(1, round(box.height * scale)))
+            glyph = cv.resize(box.mask.astype(np.uint8) * 255, (width, height), interpolation=cv.INTER_AREA) > 127
+            top = min(size - height, round(box.top * scale))
+            left = (size - width) // 2
+            feature[top : top + height, left : left + width] = glyph
+        return features.reshape(len(boxes), size * size)
+
+    def learn(self, bw_image: np.ndarray, text: str) -> None:
+        """Add the glyphs of a thresholded image with white text that reads text. Spaces in text are ignored."""
+        labels = [char for char in text if not char.isspace()]
+        boxes = segment(bw_image)
+        if len(boxes) != len(labels):
+            raise ValueError(f"Found {len(boxes)} glyphs but {text!r} has {len(labels)}")
+        self.glyphs = np.concatenate([self.glyphs, self._features(boxes, bw_image.shape[0])])
+        self.labels.extend(labels)
+
+    def read(self, bw_image: np.ndarray) -> Optional[str]:
+        """The text of a thresholded image with white text, or None if a glyph isn't close to any in the atlas."""
+        boxes = segment(bw_image)
+        if not boxes:
+            return ""
+        if not self.labels:
+            return None
+        features = self._features(boxes, bw_image.shape[0])
+
+        # For binary images, the number of differing pixels is |a| + |b| - 2 a.b, scaled by |a| + |b| to 0..1
+        feature_sums = features.sum(axis=1)[:, None]
+        glyph_sums = self.glyphs.sum(axis=1)[None, :]
+        totals = np.maximum(feature_sums + glyph_sums, 1)
+        distances = (totals - 2 * features @ self.glyphs.T) / totals
+        best = distances.argmin(axis=1)
+        if (distances[np.arange(len(boxes)), best] > self.max_distance).any():
+            return None
+
+        line_height = max(box.top + box.height for box in boxes) - min(box.top for box in boxes)
+        chars = []
+        for index, (box, glyph) in enumerate(zip(boxes, best)):
+            if index and box.left - (boxes[index - 1].left + boxes[index - 1].width) > line_height * SPACE_GAP:
+                chars.append(" ")
+            chars.append(self.labels[glyph])
+        return "".join(chars)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path, size=self.size, max_distance=self.max_distance, glyphs=self.glyphs, labels=np.array(self.labels)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "GlyphRecognizer":
+        with np.load(path) as data:
+            recognizer = cls(int(data["size"]), float(data["max_distance"]))
+            recognizer.glyphs = data["glyphs"].astype(np.float32)
+            recognizer.labels = [str(label) for label in data["labels"]]
+        return recognizer
@@ -1,13 +1,19 @@
 import platform
 import subprocess
 import sys
-from typing import Any, Optional, Tuple
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import cv2 as cv
 import numpy as np
-import pytesseract
 from PIL import Image
 
+from . import ocr, regions
+from .frame_bus import DEFAULT_FRAME_BUS_NAME, FrameBusReader
+from .frame_context import frame_context, gray_roi, threshold_with_border
+from .frame_grabber import Frame, FrameGrabber, FrameReader
+from .glyphs import GlyphRecognizer
+
 LINUX_CAPTURE = None
 LINUX_CAPTURE_DEVICES = [
     ("/dev/video100", lambda: None, False),
@@ -17,6 +23,18 @@ LINUX_CAPTURE_DEVICES = [
 LINUX_CAPTURE_BGR2RGB = False
 
 
+OCR_CACHE = ocr.OcrResultCache()
+
+# How many times the frame is halved for a coarse to fine template search, and how many of the best matches on the
+# smallest level are refined at full resolution
+PYRAMID_LEVELS = 2
+PYRAMID_CANDIDATES = 3
+# A template smaller than this on a pyramid level has too little detail left to match reliably
+MIN_PYRAMID_TEMPLATE_SIZE = 8
+
+# Configs used by the run_tesseract_* helpers
+OCR_CONFIGS = ("--psm 6 digits", "--psm 7", "--psm 8", "--psm 10")
+
 TopLeftCoords = Tuple[int, int]
 Size = Tuple[int, int]
 
@@ -33,6 +51,8 @@ def capture_linux(convert: bool = False):
                 if not LINUX_CAPTURE.isOpened():
                     LINUX_CAPTURE = None
                     continue
+                # Frames are read continuously by the frame grabber, so there is no point in buffering more
+                LINUX_CAPTURE.set(cv.CAP_PROP_BUFFERSIZE, 1)
                 LINUX_CAPTURE_BGR2RGB = should_convert
                 break
             except FileNotFoundError:
@@ -136,7 +156,70 @@ def capture_win_alt(convert: bool = False):
 
 
 # TODO: Make Windows Graphics Capture work
-capture = capture_linux if platform.system() == "Linux" else capture_win_alt
+_capture_impl = capture_linux if platform.system() == "Linux" else capture_win_alt
+# Scripts capture from executor threads, but the capture devices/handles are shared globals
+_capture_lock = threading.Lock()
+
+
+_frame_source: Optional[Union[FrameGrabber, FrameReader, FrameBusReader]] = None
+_frame_source_lock = threading.Lock()
+
+
+def _read_frame():
+    with _capture_lock:
+        return _capture_impl(False)
+
+
+def frame_source() -> Union[FrameGrabber, FrameReader, FrameBusReader]:
+    """
+    Frames published by a capture daemon if one is running, since only one process can open the capture device.
+    Otherwise frames read by a frame grabber thread in this process from the V4L2 device on Linux, or screenshots of
+    the game window taken when a frame is asked for on other platforms.
+    """
+    global _frame_source
+    with _frame_source_lock:
+        if _frame_source is None:
+            try:
+                _frame_source = FrameBusReader(DEFAULT_FRAME_BUS_NAME)
+                print(f"Reading frames from capture daemon on {DEFAULT_FRAME_BUS_NAME}")
+            except FileNotFoundError:
+                if _capture_impl is capture_linux:
+                    _frame_source = FrameGrabber(_read_frame).start()
+                else:
+                    _frame_source = FrameReader(_read_frame)
+        return _frame_source
+
+
+def convert_frame(image, convert: bool = True):
+    if not convert:
+        return image
+    if isinstance(_frame_source, FrameBusReader):
+        bgr2rgb = _frame_source.bgr2rgb
+    else:
+        bgr2rgb = _capture_impl is capture_linux and LINUX_CAPTURE_BGR2RGB
+    return cv.cvtColor(image, cv.COLOR_BGR2RGB) if bgr2rgb else image
+
+
+def capture(convert: bool = False):
+    """
+    The latest captured frame. When it comes from a capture daemon it is a view into the frame bus, not a copy, and
+    is overwritten once the daemon has published a few more frames, so copy what is needed of it before working on
+    it for longer, e.g. with regions.copy_regions.
+    """
+    return convert_frame(frame_source().latest().image, convert)
+
+
+def wait_for_frame(after_seq: int = 0, newer_than: Optional[float] = None, timeout: Optional[float] = None) -> Frame:
+    """The latest frame if it is newer than after_seq/newer_than, otherwise the next one. See FrameGrabber."""
+    return frame_source().wait_for_frame(after_seq, newer_than, timeout)
+
+
+def warm_up_ocr():
+    """
+    Load what OCR needs now rather than on the first OCR, which would otherwise be slow. The in-process engine only
+    loads it for the calling thread, script.ocr_executor() runs this on each of its threads.
+    """
+    ocr.warm_up(OCR_CONFIGS)
 
 
 def run_tesseract_digits(image, top_left, text_size, invert=True):
@@ -147,6 +230,10 @@ def run_tesseract_line(image, top_left, text_size, invert=True):
     return run_tesseract(image, top_left, text_size, "--psm 7", invert).strip()
 
 
+def run_tesseract_line_result(image, top_left, text_size, invert=True):
+    return run_tesseract_result(image, top_left, text_size, "--psm 7", invert)
+
+
 def run_tesseract_word(image, top_left, text_size, invert=True):
     return run_tesseract(image, top_left, text_size, "--psm 8", invert).strip()
 
@@ -179,35 +266,87 @@ def scale_coords(image: Any, assumed_size: Tuple[int, int], coordinates: Tuple[i
     return round(coordinates[0] * width_scale), round(coordinates[1] * height_scale)
 
 
-def run_tesseract(image, top_left, text_size, config, invert):
-    scaled_top_left = scale_coords(image, (1920, 1080), top_left)
-    scaled_text_size = scale_coords(image, (1920, 1080), text_size)
+def _preprocess(image, top_left, text_size, invert):
+    roi = gray_roi(image, regions.region(top_left, text_size))
+    return threshold_with_border(roi, invert, border_size=10)
 
-    roi = crop_image(image, scaled_top_left, scaled_text_size)
-    gray_image = cv.cvtColor(roi, cv.COLOR_BGR2GRAY)
-    _, bw_image = cv.threshold(gray_image, 30, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
-    if invert:
-        bw_image = cv.bitwise_not(bw_image)
-    border_size = 10
-    border = cv.copyMakeBorder(
-        bw_image,
-        top=border_size,
-        bottom=border_size,
-        left=border_size,
-        right=border_size,
-        borderType=cv.BORDER_CONSTANT,
-        value=[255, 255, 255],
-    )
 
-    return pytesseract.image_to_string(border, config=config)
+def run_tesseract(image, top_left, text_size, config, invert):
+    bw_image, border = _preprocess(image, top_left, text_size, invert)
+
+    # Screens that are waited on mostly don't change between polls, so the same pixels are seen again and again
+    cache_key = OCR_CACHE.key(bw_image, config)
+    text = OCR_CACHE.get(cache_key)
+    if text is not None:
+        return text
+
+    text = ocr.image_to_string(border, config=config)
+    OCR_CACHE.put(cache_key, text)
+    return text
+
+
+def run_tesseract_batch(image, ocr_regions: Sequence[Tuple[TopLeftCoords, Size, str, bool]]) -> List[str]:
+    """
+    run_tesseract for every (top_left, text_size, config, invert) region of a frame, running tesseract once per
+    distinct config rather than once per region.
+    """
+    context = frame_context(image)
+    texts: List[Optional[str]] = [None] * len(ocr_regions)
+    misses: Dict[str, List[Tuple[int, Any, np.ndarray]]] = {}
+    for index, (top_left, text_size, config, invert) in enumerate(ocr_regions):
+        bw_image, border = _preprocess(context, top_left, text_size, invert)
+        cache_key = OCR_CACHE.key(bw_image, config)
+        texts[index] = OCR_CACHE.get(cache_key)
+        if texts[index] is None:
+            # The buffer is reused for the next region of the same size
+            misses.setdefault(config, []).append((index, cache_key, border.copy()))
+
+    for config, entries in misses.items():
+        results = ocr.images_to_strings([border for _, _, border in entries], config=config)
+        for (index, cache_key, _), text in zip(entries, results):
+            OCR_CACHE.put(cache_key, text)
+            texts[index] = text
+    return texts
+
+
+def run_glyphs(image, top_left, text_size, recognizer: GlyphRecognizer, invert=True) -> Optional[str]:
+    """
+    Read text in a fixed font with a GlyphRecognizer rather than tesseract, e.g. instead of run_tesseract_digits.
+    None if a glyph isn't in the recognizer's atlas.
+    """
+    roi = gray_roi(image, regions.region(top_left, text_size))
+    # The recognizer wants white text, the opposite of what tesseract wants
+    bw_image, _ = threshold_with_border(roi, not invert, border_size=0)
+    return recognizer.read(bw_image)
+
+
+def learn_glyphs(image, top_left, text_size, text, recognizer: GlyphRecognizer, invert=True) -> None:
+    """Teach the recognizer the glyphs of a region of a sample frame that is known to read text."""
+    roi = gray_roi(image, regions.region(top_left, text_size))
+    bw_image, _ = threshold_with_border(roi, not invert, border_size=0)
+    recognizer.learn(bw_image, text)
+
+
+def run_tesseract_result(image, top_left, text_size, config, invert) -> ocr.OcrResult:
+    """Like run_tesseract, but with the confidence and box of every word from the same OCR run."""
+    bw_image, border = _preprocess(image, top_left, text_size, invert)
+
+    cache_key = OCR_CACHE.key(bw_image, config, kind="result")
+    result = OCR_CACHE.get(cache_key)
+    if result is not None:
+        return result
+
+    result = ocr.image_to_result(border, config=config)
+    OCR_CACHE.put(cache_key, result)
+    return result
 
 
 def crop_to_bounding_box(image, top_left, text_size, invert):
-    scaled_top_left = scale_coords(image, (1920, 1080), top_left)
-    scaled_text_size = scale_coords(image, (1920, 1080), text_size)
+    region = regions.region(top_left, text_size)
+    gray_image = gray_roi(image, region)
+    image = frame_context(image).image
+    scaled_top_left = region.pixel_top_left(image)
 
-    roi = crop_image(image, scaled_top_left, scaled_text_size)
-    gray_image = cv.cvtColor(roi, cv.COLOR_BGR2GRAY)
     _, bw_image = cv.threshold(gray_image, 30, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
     if not invert:
         bw_image = cv.bitwise_not(bw_image)
@@ -234,37 +373,97 @@ def crop_to_bounding_box(image, top_left, text_size, invert):
     return bounded_img
 
 
-def is_image_matching(image, template, min_x, min_y, crop_pixels=5):
-    template_height, template_width, _ = template.shape
-    scaled_template_w, scaled_template_h = scale_coords(image, (1920, 1080), (template_width, template_height))
-    template = cv.resize(template, (scaled_template_w, scaled_template_h), interpolation=cv.INTER_AREA)
-    template = template[crop_pixels : scaled_template_h - crop_pixels, crop_pixels : scaled_template_w - crop_pixels]
+def is_image_matching(
+    image,
+    template: Union[np.ndarray, regions.Template],
+    min_x,
+    min_y,
+    crop_pixels=5,
+    search_radius: Optional[int] = None,
+):
+    """
+    Whether template is on screen at min_x, min_y in pixels of the frame. By default it may be off by up to
+    2 * crop_pixels. With search_radius, it may be off by up to that many pixels and is found coarse to fine, which
+    is cheap enough to search most of the frame for things that move around like cursors.
+    """
+    if not isinstance(template, regions.Template):
+        template = regions.template(template, crop_pixels)
+    crop_pixels = template.crop_pixels
+    template = template.for_frame(image)
 
     template_height, template_width, _ = template.shape
 
+    margin = 2 * crop_pixels if search_radius is None else search_radius
     img_height, img_width, _ = image.shape
-    max_x = min(min_x + template_width + 2 * crop_pixels, img_width)
-    max_y = min(min_y + template_height + 2 * crop_pixels, img_height)
-    min_x = max(min_x - 2 * crop_pixels, 0)
-    min_y = max(min_y - 2 * crop_pixels, 0)
+    max_x = min(min_x + template_width + margin, img_width)
+    max_y = min(min_y + template_height + margin, img_height)
+    min_x = max(min_x - margin, 0)
+    min_y = max(min_y - margin, 0)
 
     cropped = image[min_y:max_y, min_x:max_x]
-    return template_matching(cropped, template)
+    return template_matching(cropped, template, PYRAMID_LEVELS if search_radius is not None else 0)
+
+
+def find_template(image, template, levels=PYRAMID_LEVELS, candidates=PYRAMID_CANDIDATES) -> Tuple[int, int]:
+    """
+    Top left of the best TM_SQDIFF_NORMED match of template in image. Both are halved levels times and matched
+    there first, then only the best few candidates are matched again at full resolution around where they were found.
+    """
+    template_height, template_width = template.shape[:2]
+    while levels > 0 and min(template_height, template_width) >> levels < MIN_PYRAMID_TEMPLATE_SIZE:
+        levels -= 1
+    if levels == 0:
+        return cv.minMaxLoc(cv.matchTemplate(image, template, cv.TM_SQDIFF_NORMED))[2]
+
+    small_image, small_template = image, template
+    for _ in range(levels):
+        small_image = cv.pyrDown(small_image)
+        small_template = cv.pyrDown(small_template)
+    res = cv.matchTemplate(small_image, small_template, cv.TM_SQDIFF_NORMED)
+
+    scale = 2**levels
+    img_height, img_width = image.shape[:2]
+    small_height, small_width = small_template.shape[:2]
+    best_val, best_loc = None, (0, 0)
+    for _ in range(candidates):
+        min_val, _, (x, y), _ = cv.minMaxLoc(res)
+        if not np.isfinite(min_val):
+            break
+        # Positions next to a candidate are the same candidate, the next one has to be somewhere else
+        res[
+            max(y - small_height // 2, 0) : y + small_height // 2 + 1,
+            max(x - small_width // 2, 0) : x + small_width // 2 + 1,
+        ] = np.inf
+
+        start_x = max(x * scale - scale, 0)
+        start_y = max(y * scale - scale, 0)
+        window = image[
+            start_y : min(y * scale + scale + template_height, img_height),
+            start_x : min(x * scale + scale + template_width, img_width),
+        ]
+        if window.shape[0] < template_height or window.shape[1] < template_width:
+            continue
+        val, _, (refined_x, refined_y), _ = cv.minMaxLoc(cv.matchTemplate(window, template, cv.TM_SQDIFF_NORMED))
+        if best_val is None or val < best_val:
+            best_val, best_loc = val, (start_x + refined_x, start_y + refined_y)
+    return best_loc
 
 
 # Adapted from https://docs.opencv.org/3.4/d4/dc6/tutorial_py_template_matching.html
-def template_matching(image, template):
+def template_matching(image, template, pyramid_levels=0):
     h, w, _ = template.shape
-    img = image.copy()
     method = cv.TM_SQDIFF_NORMED
-    # Apply template Matching
-    res = cv.matchTemplate(img, template, method)
-    min_val, max_val, min_loc, max_loc = cv.minMaxLoc(res)
-    # If the method is TM_SQDIFF or TM_SQDIFF_NORMED, take minimum
-    if method in [cv.TM_SQDIFF, cv.TM_SQDIFF_NORMED]:
-        top_left = min_loc
+    if pyramid_levels:
+        top_left = find_template(image, template, pyramid_levels)
     else:
-        top_left = max_loc
+        # Apply template Matching, matchTemplate doesn't modify the image so it doesn't need a copy
+        res = cv.matchTemplate(image, template, method)
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(res)
+        # If the method is TM_SQDIFF or TM_SQDIFF_NORMED, take minimum
+        if method in [cv.TM_SQDIFF, cv.TM_SQDIFF_NORMED]:
+            top_left = min_loc
+        else:
+            top_left = max_loc
     bottom_right = (top_left[0] + w, top_left[1] + h)
 
     # The tolerance has to be kinda big or else things sometimes get flaky
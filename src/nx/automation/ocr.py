@@ -0,0 +1,255 @@
+import hashlib
+import shlex
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import pytesseract
+
+try:
+    import tesserocr
+
+    tesserocr_installed = True
+except ImportError:
+    tesserocr_installed = False
+
+DEFAULT_LANG = "eng"
+# Enough for every region of a few screens that are waited on
+DEFAULT_CACHE_ENTRIES = 256
+
+
+OcrResult = pytesseract.OcrResult
+OcrWord = pytesseract.OcrWord
+
+
+class OcrEngine(ABC):
+    @abstractmethod
+    def image_to_string(self, image: np.ndarray, config: str = "") -> str:
+        pass
+
+    @abstractmethod
+    def image_to_result(self, image: np.ndarray, config: str = "") -> OcrResult:
+        """The text along with the confidence and box of every word, from a single recognition."""
+        pass
+
+    def images_to_strings(self, images: Sequence[np.ndarray], config: str = "") -> List[str]:
+        return [self.image_to_string(image, config) for image in images]
+
+    def warm_up(self, configs: Sequence[str]) -> None:
+        """Get everything the configs need loaded, so that the first real OCR isn't slow."""
+        blank = np.full((32, 32), 255, dtype=np.uint8)
+        for config in configs:
+            self.image_to_string(blank, config)
+
+
+class SubprocessOcrEngine(OcrEngine):
+    """
+    Runs the tesseract executable for every image. Works everywhere tesseract is installed, but slowly.
+    Uses the bundled pytesseract, which passes images through pipes rather than temporary files, with a profile
+    per config so the command line is only worked out once.
+
+    The executable is looked up on the PATH, unless tesseract_cmd or the TESSERACT_CMD environment variable gives
+    its path. Setting tesseract_cmd on the pytesseract package has no effect, since it isn't used.
+    """
+
+    def __init__(self, tesseract_cmd: Optional[str] = None):
+        if tesseract_cmd is not None:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self._profiles: Dict[str, pytesseract.OcrProfile] = {}
+        self._lock = threading.Lock()
+
+    def profile(self, config: str) -> pytesseract.OcrProfile:
+        profile = self._profiles.get(config)
+        if profile is None:
+            with self._lock:
+                profile = self._profiles.get(config)
+                if profile is None:
+                    profile = self._profiles[config] = pytesseract.OcrProfile(config)
+        return profile
+
+    def image_to_string(self, image: np.ndarray, config: str = "") -> str:
+        return self.profile(config).image_to_string(image)
+
+    def image_to_result(self, image: np.ndarray, config: str = "") -> OcrResult:
+        return self.profile(config).image_to_result(image)
+
+    def images_to_strings(self, images: Sequence[np.ndarray], config: str = "") -> List[str]:
+        # Starting tesseract is most of the cost of OCRing a small image, so it is started once for all of them
+        return self.profile(config).images_to_strings(images)
+
+    def warm_up(self, configs: Sequence[str]) -> None:
+        for config in configs:
+            self.profile(config).warm_up()
+
+
+class TesseractConfig:
+    """Command line style tesseract config, e.g. "--psm 6 digits", split into what the tesseract API takes."""
+
+    def __init__(self, config: str):
+        self.psm: Optional[int] = None
+        self.oem: Optional[int] = None
+        self.lang = DEFAULT_LANG
+        self.variables: Dict[str, str] = {}
+        self.config_files: List[str] = []
+
+        args = iter(shlex.split(config))
+        for arg in args:
+            if arg == "--psm":
+                self.psm = int(next(args))
+            elif arg == "--oem":
+                self.oem = int(next(args))
+            elif arg == "-l":
+                self.lang = next(args)
+            elif arg == "--dpi":
+                self.variables["user_defined_dpi"] = next(args)
+            elif arg == "-c":
+                name, _, value = next(args).partition("=")
+                self.variables[name] = value
+            else:
+                # Like "digits", a file in tessdata/configs
+                self.config_files.append(arg)
+
+
+class TesserocrEngine(OcrEngine):
+    """
+    Keeps tesseract loaded in this process with tesserocr, so OCR doesn't start a process and load the language
+    model every time, and takes NumPy arrays without encoding them.
+
+    A tesseract API object can't be used by two threads at once, and config files and some variables only take
+    effect when it is initialised, so there is one per thread and config. warm_up() therefore only loads the APIs
+    of the calling thread.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if not tesserocr_installed:
+            raise RuntimeError("tesserocr is not installed")
+        self.path = path
+        self._local = threading.local()
+
+    def _api(self, config: str) -> "tesserocr.PyTessBaseAPI":
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get(config)
+        if api is None:
+            parsed = TesseractConfig(config)
+            api = tesserocr.PyTessBaseAPI(init=False)
+            init_args = {"lang": parsed.lang, "variables": parsed.variables, "configs": parsed.config_files}
+            if self.path is not None:
+                init_args["path"] = self.path
+            if parsed.oem is not None:
+                init_args["oem"] = parsed.oem
+            api.Init(**init_args)
+            if parsed.psm is not None:
+                api.SetPageSegMode(parsed.psm)
+            apis[config] = api
+        return api
+
+    @staticmethod
+    def _image_layout(image: np.ndarray) -> Tuple[np.ndarray, int]:
+        if image.dtype != np.uint8:
+            raise TypeError(f"Unsupported image type: {image.dtype}")
+        if image.ndim == 2:
+            bytes_per_pixel = 1
+        elif image.ndim == 3 and image.shape[2] in (3, 4):
+            bytes_per_pixel = image.shape[2]
+        else:
+            raise TypeError(f"Unsupported image shape: {image.shape}")
+        return np.ascontiguousarray(image), bytes_per_pixel
+
+    def _set_image(self, image: np.ndarray, config: str) -> "tesserocr.PyTessBaseAPI":
+        api = self._api(config)
+        image, bytes_per_pixel = self._image_layout(image)
+        height, width = image.shape[:2]
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, image.strides[0])
+        return api
+
+    def image_to_string(self, image: np.ndarray, config: str = "") -> str:
+        return self._set_image(image, config).GetUTF8Text()
+
+    def image_to_result(self, image: np.ndarray, config: str = "") -> OcrResult:
+        # Same TSV as the tesseract executable writes, so both engines assemble the text alike
+        return pytesseract.tsv_to_result(self._set_image(image, config).GetTSVText(0))
+
+
+class OcrResultCache:
+    """
+    Bounded LRU cache of OCR results, keyed on a hash of the preprocessed image and the config.
+    Images are thresholded before they are hashed, so a region that doesn't visibly change keeps hitting the cache.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image: np.ndarray, config: str, kind: str = "text") -> Hashable:
+        """kind tells apart results of different types for the same image, like text and OcrResult."""
+        digest = hashlib.blake2b(np.ascontiguousarray(image), digest_size=16).digest()
+        return kind, config, image.shape, digest
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Hashable, result: Any) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_engine: Optional[OcrEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> OcrEngine:
+    """The in-process engine if tesserocr is installed, running the tesseract executable otherwise."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            if tesserocr_installed:
+                _engine = TesserocrEngine()
+            else:
+                print("tesserocr is not installed, running tesseract in a new process for every OCR")
+                _engine = SubprocessOcrEngine()
+        return _engine
+
+
+def set_engine(engine: OcrEngine) -> None:
+    global _engine
+    with _engine_lock:
+        _engine = engine
+
+
+def image_to_string(image: np.ndarray, config: str = "") -> str:
+    return get_engine().image_to_string(image, config)
+
+
+def image_to_result(image: np.ndarray, config: str = "") -> OcrResult:
+    return get_engine().image_to_result(image, config)
+
+
+def images_to_strings(images: Sequence[np.ndarray], config: str = "") -> List[str]:
+    return get_engine().images_to_strings(images, config)
+
+
+def warm_up(configs: Sequence[str]) -> None:
+    get_engine().warm_up(configs)
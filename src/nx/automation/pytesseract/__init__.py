@@ -1,6 +1,10 @@
 # flake8: noqa: F401
 from .pytesseract import (
     ALTONotSupported,
+    LanguageNotSupported,
+    OcrProfile,
+    OcrResult,
+    OcrWord,
     Output,
     TesseractError,
     TesseractNotFoundError,
@@ -12,7 +16,9 @@ from .pytesseract import (
     image_to_data,
     image_to_osd,
     image_to_pdf_or_hocr,
+    image_to_result,
     image_to_string,
+    images_to_strings,
     run_and_get_multiple_output,
     run_and_get_output,
 )
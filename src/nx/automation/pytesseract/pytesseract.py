@@ -13,14 +13,19 @@ from glob import iglob
 from io import BytesIO
 from os import environ, extsep, linesep, remove
 from os.path import normcase, normpath, realpath
+from shutil import which
 from tempfile import NamedTemporaryFile
 from time import sleep
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 
 from packaging.version import InvalidVersion, Version, parse
 from PIL import Image
 
-tesseract_cmd = "tesseract"
+# Like with the pytesseract package, set this to the full path of the executable if it isn't on the PATH, which
+# is the usual case on Windows. The TESSERACT_CMD environment variable sets it without touching code.
+tesseract_cmd = environ.get("TESSERACT_CMD", "tesseract")
+# Pass images to tesseract and read its output through pipes rather than temporary files
+use_pipes = True
 
 try:
     from numpy import ndarray
@@ -81,6 +86,32 @@ class Output:
     STRING = "string"
 
 
+class OcrWord(NamedTuple):
+    text: str
+    # 0 to 100
+    conf: float
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+class OcrResult(NamedTuple):
+    """Text with the words it is made of, from one tesseract run. Lines are separated by newlines."""
+
+    text: str
+    words: List[OcrWord]
+
+    @property
+    def min_conf(self) -> float:
+        """Confidence of the least certain word, 0 if no words were found."""
+        return min((word.conf for word in self.words), default=0.0)
+
+    @property
+    def mean_conf(self) -> float:
+        return sum(word.conf for word in self.words) / len(self.words) if self.words else 0.0
+
+
 class PandasNotSupported(EnvironmentError):
     def __init__(self):
         super().__init__("Missing pandas package")
@@ -96,7 +127,8 @@ class TesseractError(RuntimeError):
 class TesseractNotFoundError(EnvironmentError):
     def __init__(self):
         super().__init__(
-            f"{tesseract_cmd} is not installed or it's not in your PATH." f" See README file for more information.",
+            f"{tesseract_cmd} is not installed or it's not in your PATH. Set the TESSERACT_CMD environment variable "
+            f"or nx.automation.pytesseract.pytesseract.tesseract_cmd to the path of the tesseract executable.",
         )
 
 
@@ -107,6 +139,13 @@ class TSVNotSupported(EnvironmentError):
         )
 
 
+class LanguageNotSupported(EnvironmentError):
+    def __init__(self, languages):
+        super().__init__(
+            f"Tesseract languages not installed: {', '.join(languages)}",
+        )
+
+
 class ALTONotSupported(EnvironmentError):
     def __init__(self):
         super().__init__(
@@ -231,22 +270,14 @@ def subprocess_args(include_stdout=True):
     return kwargs
 
 
-def run_tesseract(
-    input_filename,
-    output_filename_base,
-    extension,
-    lang,
-    config="",
-    nice=0,
-    timeout=0,
-):
+def tesseract_cmd_args(input_filename, output_filename_base, extension, lang, config="", nice=0, cmd=None):
     cmd_args = []
     not_windows = not (sys.platform == "win32")
 
     if not_windows and nice != 0:
         cmd_args += ("nice", "-n", str(nice))
 
-    cmd_args += (tesseract_cmd, input_filename, output_filename_base)
+    cmd_args += (cmd or tesseract_cmd, input_filename, output_filename_base)
 
     if lang is not None:
         cmd_args += ("-l", lang)
@@ -258,6 +289,19 @@ def run_tesseract(
         if _extension not in {"box", "osd", "tsv", "xml"}:
             cmd_args.append(_extension)
     LOGGER.debug("%r", cmd_args)
+    return cmd_args
+
+
+def run_tesseract(
+    input_filename,
+    output_filename_base,
+    extension,
+    lang,
+    config="",
+    nice=0,
+    timeout=0,
+):
+    cmd_args = tesseract_cmd_args(input_filename, output_filename_base, extension, lang, config, nice)
 
     try:
         proc = subprocess.Popen(cmd_args, **subprocess_args())
@@ -342,6 +386,16 @@ def _run_and_get_output(
         )
 
 
+def encode_image(image):
+    """The image as uncompressed PNM, which is the cheapest format to write and for tesseract to read."""
+    image, _ = prepare(image)
+    if image.mode not in {"1", "L", RGB_MODE}:
+        image = image.convert(RGB_MODE)
+    buffer = BytesIO()
+    image.save(buffer, format="PPM")
+    return buffer.getvalue()
+
+
 def run_and_get_output(
     image,
     extension="",
@@ -351,33 +405,130 @@ def run_and_get_output(
     timeout=0,
     return_bytes=False,
 ):
-    cmd_args = [tesseract_cmd, "stdin", "stdout"]
+    """
+    Runs tesseract with the image on its stdin and returns what it writes to stdout, so nothing touches the disk.
+    Set use_pipes to False to go through temporary files instead.
+    """
+    if not use_pipes:
+        return _run_and_get_output(image, extension, lang, config, nice, timeout, return_bytes)
 
-    if not sys.platform.startswith("win32") and nice != 0:
-        cmd_args += ("nice", "-n", str(nice))
+    if isinstance(image, str):
+        input_filename, input_data = realpath(normpath(normcase(image))), None
+    else:
+        input_filename, input_data = "stdin", encode_image(image)
+    return _run_piped(input_filename, input_data, extension, lang, config, nice, timeout, return_bytes)
 
-    if lang is not None:
-        cmd_args += ("-l", lang)
 
-    if config:
-        cmd_args += shlex.split(config)
+def _run_piped(input_filename, input_data, extension, lang, config, nice, timeout, return_bytes):
+    cmd_args = tesseract_cmd_args(input_filename, "stdout", extension, lang, config, nice)
+    return _communicate(cmd_args, input_data, timeout, return_bytes)
 
-    try:
-        proc = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-        image.save(proc.stdin, "PNG")
-        try:
-            (stdout_data, stderr_data) = proc.communicate()
-            if proc.returncode:
-                raise TesseractError(proc.returncode, get_errors(stderr_data))
-        except subprocess.TimeoutExpired:
-            kill(proc, -1)
-            raise RuntimeError("Tesseract process timeout")
 
-        return stdout_data.decode(DEFAULT_ENCODING)
+def _communicate(cmd_args, input_data, timeout, return_bytes):
+    try:
+        proc = subprocess.Popen(cmd_args, **subprocess_args())
     except OSError as e:
         if e.errno != ENOENT:
-            raise e
-        raise TesseractNotFoundError()
+            raise
+        else:
+            raise TesseractNotFoundError()
+
+    try:
+        output, error_string = proc.communicate(input_data, timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        kill(proc, -1)
+        proc.stdin.close()
+        proc.stdout.close()
+        proc.stderr.close()
+        raise RuntimeError("Tesseract process timeout")
+
+    if proc.returncode:
+        raise TesseractError(proc.returncode, get_errors(error_string))
+    return output if return_bytes else output.decode(DEFAULT_ENCODING)
+
+
+def images_to_strings(
+    images,
+    lang=None,
+    config="",
+    nice=0,
+    timeout=0,
+):
+    """
+    Returns the result of a single Tesseract OCR run on all the provided images, one string per image.
+    The images are passed as the pages of one uncompressed multi-page TIFF, so they share the config.
+    """
+    if not images:
+        return []
+    output = _run_piped("stdin", encode_pages(images), "txt", lang, config, nice, timeout, False)
+    return split_pages(output, len(images))
+
+
+def encode_pages(images):
+    """The images as the pages of one uncompressed multi-page TIFF."""
+    pages = []
+    for image in images:
+        page, _ = prepare(image)
+        if page.mode not in {"1", "L", RGB_MODE}:
+            page = page.convert(RGB_MODE)
+        pages.append(page)
+    buffer = BytesIO()
+    pages[0].save(buffer, format="TIFF", save_all=True, append_images=pages[1:])
+    return buffer.getvalue()
+
+
+def split_pages(output, num_pages):
+    # Tesseract separates the text of pages with its page_separator, a form feed unless the config changes it
+    texts = output.split("\f")
+    if len(texts) < num_pages:
+        raise TesseractError(0, f"Expected text for {num_pages} pages but got {len(texts)}")
+    return texts[:num_pages]
+
+
+class OcrProfile:
+    """
+    A tesseract config prepared once to be run many times. The executable is resolved, the version and languages
+    are checked and the command line is built up front, so running it only starts tesseract.
+    Always passes images through pipes.
+    """
+
+    def __init__(self, config="", lang=None, nice=0, timeout=0):
+        cmd = which(tesseract_cmd)
+        if cmd is None:
+            raise TesseractNotFoundError()
+        self.version = get_tesseract_version(cached=True)
+        languages = lang
+        if languages is None:
+            config_args = shlex.split(config)
+            # Tesseract's own default
+            languages = config_args[config_args.index("-l") + 1] if "-l" in config_args[:-1] else "eng"
+        installed = get_languages(cached=True)
+        missing = [language for language in languages.split("+") if language not in installed]
+        if missing:
+            raise LanguageNotSupported(missing)
+
+        self.config = config
+        self.lang = lang
+        self.timeout = timeout
+        self._txt_args = tesseract_cmd_args("stdin", "stdout", "txt", lang, config, nice, cmd)
+        tsv_config = f"-c tessedit_create_tsv=1 {config.strip()}"
+        self._tsv_args = tesseract_cmd_args("stdin", "stdout", "tsv", lang, tsv_config, nice, cmd)
+
+    def image_to_string(self, image):
+        return _communicate(self._txt_args, encode_image(image), self.timeout, False)
+
+    def image_to_result(self, image):
+        return tsv_to_result(_communicate(self._tsv_args, encode_image(image), self.timeout, False))
+
+    def images_to_strings(self, images):
+        if not images:
+            return []
+        output = _communicate(self._txt_args, encode_pages(images), self.timeout, False)
+        return split_pages(output, len(images))
+
+    def warm_up(self):
+        """Run tesseract once, so the executable and language data are loaded from disk before they are needed."""
+        self.image_to_string(Image.new("L", (32, 32), 255))
 
 
 def file_to_dict(tsv, cell_delimiter, str_col_idx):
@@ -626,6 +777,48 @@ def image_to_data(
     }[output_type]()
 
 
+def tsv_to_result(tsv):
+    """Words of tesseract TSV output, with the text assembled from them. A header line is optional."""
+    words = []
+    lines = []
+    last_line = None
+    for row in tsv.splitlines():
+        cells = row.split("\t")
+        # Only word rows, level 5, have text and a confidence
+        if len(cells) < 11 or cells[0] != "5":
+            continue
+        text = cells[11] if len(cells) > 11 else ""
+        if not text.strip():
+            continue
+        line = (cells[1], cells[2], cells[3], cells[4])
+        if line != last_line:
+            lines.append([])
+            last_line = line
+        lines[-1].append(text)
+        left, top, width, height = (int(cell) for cell in cells[6:10])
+        words.append(OcrWord(text, float(cells[10]), left, top, width, height))
+    return OcrResult("\n".join(" ".join(line) for line in lines), words)
+
+
+def image_to_result(
+    image,
+    lang=None,
+    config="",
+    nice=0,
+    timeout=0,
+):
+    """
+    Returns the text, and the confidence and box of every word, from a single Tesseract run.
+    Requires Tesseract 3.05+
+    """
+
+    if get_tesseract_version(cached=True) < TESSERACT_MIN_VERSION:
+        raise TSVNotSupported()
+
+    config = f"-c tessedit_create_tsv=1 {config.strip()}"
+    return tsv_to_result(run_and_get_output(image, "tsv", lang, config, nice, timeout))
+
+
 def image_to_osd(
     image,
     lang="osd",
@@ -0,0 +1,155 @@
+import threading
+import weakref
+from typing import Dict, Iterable, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+# Regions and templates are declared at this resolution and scaled to whatever the capture device delivers
+REFERENCE_SIZE = (1920, 1080)
+DEFAULT_TEMPLATE_CROP_PIXELS = 5
+
+Coords = Tuple[int, int]
+FrameSize = Tuple[int, int]
+
+
+def _scale(frame_size: FrameSize, coordinates: Coords) -> Coords:
+    # Same rounding as image_processing.scale_coords
+    actual_h, actual_w = frame_size
+    desired_w, desired_h = REFERENCE_SIZE
+    height_scale = actual_h / desired_h
+    width_scale = actual_w / desired_w
+    return round(coordinates[0] * width_scale), round(coordinates[1] * height_scale)
+
+
+class _CompiledRegion:
+    def __init__(self, frame_size: FrameSize, top_left: Coords, size: Coords):
+        self.frame_size = frame_size
+        self.top_left = top_left
+        self.size = size
+        x, y = top_left
+        w, h = size
+        self.rows = slice(y, y + h)
+        self.cols = slice(x, x + w)
+
+
+class Region:
+    """
+    A rectangle of the screen declared in REFERENCE_SIZE coordinates.
+
+    The pixel coordinates are computed for the first frame of a size and reused until frames of another size are
+    seen, which only happens when the capture resolution changes.
+    """
+
+    def __init__(self, top_left: Coords, size: Coords):
+        self.top_left = top_left
+        self.size = size
+        self._compiled: Optional[_CompiledRegion] = None
+
+    def _compile(self, image: np.ndarray) -> _CompiledRegion:
+        compiled = self._compiled
+        frame_size = image.shape[:2]
+        if compiled is None or compiled.frame_size != frame_size:
+            # Replaced in one assignment, so other threads see either the old or the new one
+            compiled = _CompiledRegion(frame_size, _scale(frame_size, self.top_left), _scale(frame_size, self.size))
+            self._compiled = compiled
+        return compiled
+
+    def pixel_top_left(self, image: np.ndarray) -> Coords:
+        return self._compile(image).top_left
+
+    def pixel_size(self, image: np.ndarray) -> Coords:
+        return self._compile(image).size
+
+    def crop(self, image: np.ndarray) -> np.ndarray:
+        compiled = self._compile(image)
+        return image[compiled.rows, compiled.cols]
+
+    def __repr__(self) -> str:
+        return f"Region({self.top_left}, {self.size})"
+
+
+class Template:
+    """
+    An image to look for on screen, at REFERENCE_SIZE scale. It is resized and cropped once per capture resolution
+    rather than every time it is matched.
+    """
+
+    def __init__(self, image: np.ndarray, crop_pixels: int = DEFAULT_TEMPLATE_CROP_PIXELS):
+        # A copy, so that the registry doesn't keep the image it was looked up by alive
+        self.image = image.copy()
+        self.crop_pixels = crop_pixels
+        self._scaled: Optional[Tuple[FrameSize, np.ndarray]] = None
+
+    def for_frame(self, image: np.ndarray) -> np.ndarray:
+        """The template resized to the scale of the frame, with crop_pixels cut off every edge."""
+        scaled = self._scaled
+        frame_size = image.shape[:2]
+        if scaled is None or scaled[0] != frame_size:
+            template_height, template_width = self.image.shape[:2]
+            scaled_w, scaled_h = _scale(frame_size, (template_width, template_height))
+            resized = cv.resize(self.image, (scaled_w, scaled_h), interpolation=cv.INTER_AREA)
+            crop = self.crop_pixels
+            scaled = (frame_size, resized[crop : scaled_h - crop, crop : scaled_w - crop])
+            self._scaled = scaled
+        return scaled[1]
+
+
+class RegionRegistry:
+    """
+    Hands out one Region per rectangle and one Template per template image, so that what they compile for a
+    resolution is shared by every caller.
+    """
+
+    def __init__(self):
+        self._regions: Dict[Tuple[Coords, Coords], Region] = {}
+        # Arrays aren't hashable, so templates are looked up by the id of the array while it is alive
+        self._templates: Dict[Tuple[int, int], Tuple[weakref.ref, Template]] = {}
+        # Reentrant, because a template's weakref callback can run during garbage collection while it is held
+        self._lock = threading.RLock()
+
+    def region(self, top_left: Coords, size: Coords) -> Region:
+        key = (tuple(top_left), tuple(size))
+        region = self._regions.get(key)
+        if region is None:
+            with self._lock:
+                region = self._regions.setdefault(key, Region(*key))
+        return region
+
+    def template(self, image: np.ndarray, crop_pixels: int = DEFAULT_TEMPLATE_CROP_PIXELS) -> Template:
+        key = (id(image), crop_pixels)
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is not None and entry[0]() is image:
+                return entry[1]
+
+            def forget(_: weakref.ref) -> None:
+                with self._lock:
+                    if self._templates.get(key) is entry:
+                        del self._templates[key]
+
+            entry = (weakref.ref(image, forget), Template(image, crop_pixels))
+            self._templates[key] = entry
+            return entry[1]
+
+
+REGISTRY = RegionRegistry()
+
+
+def region(top_left: Coords, size: Coords) -> Region:
+    return REGISTRY.region(top_left, size)
+
+
+def template(image: np.ndarray, crop_pixels: int = DEFAULT_TEMPLATE_CROP_PIXELS) -> Template:
+    return REGISTRY.template(image, crop_pixels)
+
+
+def copy_regions(image: np.ndarray, watched: Iterable[Region]) -> np.ndarray:
+    """
+    A frame the size of image with only the watched regions copied from it and black elsewhere. Much cheaper than
+    copying the whole frame, and the regions stay readable after image is overwritten, like a frame bus slot is.
+    """
+    copy = np.zeros_like(image)
+    for watched_region in watched:
+        watched_region.crop(copy)[...] = watched_region.crop(image)
+    return copy
@@ -0,0 +1,130 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from . import regions
+from .image_processing import TopLeftCoords
+
+# Templates are compared on the frame halved this many times, which is plenty to tell screens apart
+DEFAULT_LEVEL = 1
+# TM_CCOEFF_NORMED score at or above which a template counts as being on screen, 1 is a perfect match
+DEFAULT_MIN_SCORE = 0.8
+# How far from its expected location a template is looked for, in pixels of the 1920x1080 screen
+DEFAULT_MARGIN = 10
+
+
+class ScreenScore(NamedTuple):
+    name: str
+    # TM_CCOEFF_NORMED of the best match, higher is better
+    score: float
+    # Where the template matched, in pixels of the frame
+    location: Tuple[int, int]
+
+
+def pyramid(image: np.ndarray, levels: int) -> List[np.ndarray]:
+    """The image and the image halved up to levels times, in grayscale."""
+    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    result = [gray]
+    for _ in range(levels):
+        result.append(cv.pyrDown(result[-1]))
+    return result
+
+
+class _CompiledScreen:
+    def __init__(self, frame_size: Tuple[int, int], template: np.ndarray, window: Tuple[slice, slice]):
+        self.frame_size = frame_size
+        self.template = template
+        self.window = window
+
+
+class _Screen:
+    def __init__(self, name: str, template: regions.Template, location: TopLeftCoords, margin: int):
+        self.name = name
+        self.template = template
+        self.location = location
+        self.margin = margin
+        self._compiled: Optional[_CompiledScreen] = None
+
+    def compile(self, image: np.ndarray, level: int) -> _CompiledScreen:
+        compiled = self._compiled
+        frame_size = image.shape[:2]
+        if compiled is None or compiled.frame_size != frame_size:
+            # Shrunk the same way as the frame, so that both are blurred alike
+            template = pyramid(self.template.for_frame(image), level)[-1]
+            crop = self.template.crop_pixels
+            region = regions.region(
+                (self.location[0] - self.margin, self.location[1] - self.margin),
+                (self.margin * 2, self.margin * 2),
+            )
+            x, y = region.pixel_top_left(image)
+            margin_w, margin_h = region.pixel_size(image)
+            scale = 2**level
+            height, width = frame_size
+            # The cropped template sits crop pixels into the expected location
+            min_x = max((x + crop) // scale, 0)
+            min_y = max((y + crop) // scale, 0)
+            max_x = min(-(-(x + crop + margin_w) // scale) + template.shape[1], width // scale)
+            max_y = min(-(-(y + crop + margin_h) // scale) + template.shape[0], height // scale)
+            compiled = _CompiledScreen(frame_size, template, (slice(min_y, max_y), slice(min_x, max_x)))
+            self._compiled = compiled
+        return compiled
+
+
+class ScreenClassifier:
+    """
+    Tells which of a number of screens is showing, each recognised by a template at a known location.
+
+    The frame is converted to grayscale and shrunk once for all templates, and each template is only matched in a
+    small window around where it is expected, so checking many screens costs little more than checking one.
+
+    Matches are scored with TM_CCOEFF_NORMED rather than the TM_SQDIFF_NORMED is_image_matching uses, since that
+    ignores overall brightness and so tells different screens apart much more clearly. Templates therefore need
+    some detail, a single flat color scores 0 everywhere.
+    """
+
+    def __init__(self, level: int = DEFAULT_LEVEL, min_score: float = DEFAULT_MIN_SCORE):
+        self.level = level
+        self.min_score = min_score
+        self._screens: List[_Screen] = []
+
+    def add(
+        self,
+        name: str,
+        template: np.ndarray,
+        location: TopLeftCoords,
+        crop_pixels: int = regions.DEFAULT_TEMPLATE_CROP_PIXELS,
+        margin: int = DEFAULT_MARGIN,
+    ) -> "ScreenClassifier":
+        """Add a screen recognised by template, a 1920x1080 scale image whose top left is expected at location."""
+        self._screens.append(_Screen(name, regions.template(template, crop_pixels), location, margin))
+        return self
+
+    def scores(self, image: np.ndarray) -> List[ScreenScore]:
+        """A score for every screen, best first. Screens whose window doesn't fit the template score 0."""
+        level_image = pyramid(image, self.level)[-1]
+        scale = 2**self.level
+        results = []
+        for screen in self._screens:
+            compiled = screen.compile(image, self.level)
+            window = level_image[compiled.window]
+            template = compiled.template
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1] or template.size == 0:
+                results.append(ScreenScore(screen.name, 0.0, (0, 0)))
+                continue
+            res = cv.matchTemplate(window, template, cv.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv.minMaxLoc(res)
+            location = (
+                (compiled.window[1].start + max_loc[0]) * scale,
+                (compiled.window[0].start + max_loc[1]) * scale,
+            )
+            results.append(ScreenScore(screen.name, float(max_val), location))
+        results.sort(key=lambda result: result.score, reverse=True)
+        return results
+
+    def classify(self, image: np.ndarray) -> Optional[str]:
+        """The name of the best matching screen, or None if no screen matches well enough."""
+        results = self.scores(image)
+        if results and results[0].score >= self.min_score:
+            return results[0].name
+        return None
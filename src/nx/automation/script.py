@@ -1,9 +1,24 @@
 import asyncio
+import inspect
+import os
+import threading
 import time
-from typing import Any, Awaitable, Callable, Coroutine, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 from ..controller import Button, Command, Controller, DPad
-from . import image_processing
+from . import change_detection, image_processing, ocr, regions
+from .frame_context import FrameContext
 from .image_processing import Size, TopLeftCoords
 
 # TODO: Evaluate whether we need 160 or can revert to 80
@@ -14,27 +29,138 @@ Matcher = Callable[[str], bool]
 MatchHandler = Callable[[], Coroutine[Any, Any, Tuple[int, Optional[str]]]]
 MatchArgs = Tuple[Matcher, MatchHandler, TopLeftCoords, Size, bool]
 
+T = TypeVar("T")
+
+# OCR releases the GIL while tesseract runs, so regions of a frame are recognized in parallel on this many threads
+OCR_WORKERS = os.cpu_count() or 4
+_ocr_executor: Optional[ThreadPoolExecutor] = None
+_ocr_warm_ups: List["Future[None]"] = []
+
+
+async def run_blocking(func: Callable[..., T], *args: Any) -> T:
+    """Run blocking capture/OCR work on the default executor so that inputs keep flowing on the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def remaining(start_time: float, timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else max(0.0, start_time + timeout - time.time())
+
+
+def _warm_up_ocr_threads(executor: ThreadPoolExecutor) -> List["Future[None]"]:
+    # The in-process engine keeps tesseract loaded per thread, so every thread warms up its own
+    workers = OCR_WORKERS if isinstance(ocr.get_engine(), ocr.TesserocrEngine) else 1
+    # Each warm-up holds its thread until all have run, so that no thread runs two of them
+    barrier = threading.Barrier(workers)
+
+    def warm_up() -> None:
+        try:
+            image_processing.warm_up_ocr()
+        finally:
+            barrier.wait()
+
+    return [executor.submit(warm_up) for _ in range(workers)]
+
+
+def ocr_executor() -> ThreadPoolExecutor:
+    """The OCR threads, which start loading what OCR needs in the background as soon as they are created."""
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+        _ocr_warm_ups.extend(_warm_up_ocr_threads(_ocr_executor))
+    return _ocr_executor
+
+
+def wait_for_ocr_warm_up() -> None:
+    """
+    Wait until the OCR threads have loaded what OCR needs. Raises what went wrong if they couldn't, e.g. because
+    tesseract or one of its languages isn't installed.
+    """
+    ocr_executor()
+    for future in _ocr_warm_ups:
+        future.result()
+
+
+def _read_confident_line(
+    frame: Any, top_left: TopLeftCoords, size: Size, invert: bool, min_confidence: float
+) -> Optional[str]:
+    result = image_processing.run_tesseract_line_result(frame, top_left, size, invert)
+    return result.text if result.min_conf >= min_confidence else None
+
+
+def read_line(
+    frame: Any, top_left: TopLeftCoords, size: Size, invert: bool, min_confidence: Optional[float] = None
+) -> "asyncio.Future[Optional[str]]":
+    """
+    OCR a line on the OCR threads. With min_confidence, a read in which any word has a lower confidence (0 to 100)
+    gives None instead of the text, at no extra OCR cost.
+    """
+    if min_confidence is None:
+        return asyncio.get_running_loop().run_in_executor(
+            ocr_executor(), image_processing.run_tesseract_line, frame, top_left, size, invert
+        )
+    return asyncio.get_running_loop().run_in_executor(
+        ocr_executor(), _read_confident_line, frame, top_left, size, invert, min_confidence
+    )
+
+
+async def first_match(
+    frame: Any, matchers: Sequence[MatchArgs], min_confidence: Optional[float] = None
+) -> Optional[int]:
+    """
+    Index of the first matcher whose region matches, OCRing all regions of the frame concurrently.
+    Results are checked in order, so an earlier matcher still wins over a later one that finished first, and the
+    regions that haven't started yet are cancelled as soon as the outcome is known.
+    """
+    # Shared by the regions, so the frame is only converted to grayscale once
+    context = FrameContext(frame)
+    futures = [read_line(context, top_left, size, invert, min_confidence) for _, _, top_left, size, invert in matchers]
+    try:
+        for index, (future, (matcher, _, _, _, _)) in enumerate(zip(futures, matchers)):
+            text = await future
+            if text is not None and matcher(text):
+                return index
+        return None
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _capture_regions(watched: Sequence[Tuple[TopLeftCoords, Size]]) -> Any:
+    # The frame may be a view into the frame bus that is overwritten while the regions are OCRed
+    return regions.copy_regions(image_processing.capture(), [regions.region(*region) for region in watched])
+
 
 class Script:
     def __init__(self, controller: Controller):
         self.controller = controller
+        # Fails here if OCR isn't set up rather than at the first read, which then isn't slow either
+        wait_for_ocr_warm_up()
 
-    def _send_cmd(self, command: Command):
-        self.controller.send_cmd(command)
+    # With an AsyncController these return a coroutine, which _send awaits
+    def _send_cmd(self, command: Command) -> Optional[Awaitable[None]]:
+        return self.controller.send_cmd(command)
+
+    def _send_cmds(self, *commands: Command) -> Optional[Awaitable[None]]:
+        return self.controller.send_cmds(commands)
+
+    @staticmethod
+    async def _send(result: Optional[Awaitable[None]]) -> None:
+        if inspect.isawaitable(result):
+            await result
 
     async def _press_dpad(self, dpad: DPad, hold_time: int, wait_time: int) -> None:
         if wait_time is None or wait_time < 0:
             wait_time = hold_time
-        self._send_cmd(Command().dpad(dpad).hold(hold_time))
-        self._send_cmd(Command().hold(wait_time))
+        await self._send(self._send_cmds(Command.NEUTRAL.dpad(dpad).hold(hold_time), Command.NEUTRAL.hold(wait_time)))
         # self.controller.p_wait((hold_time + wait_time) / 1000.0)
         await self.controller.wait_for_inputs()
 
     async def _press_button(self, button: Button, hold_time: int, wait_time: int) -> None:
         if wait_time is None or wait_time < 0:
             wait_time = hold_time
-        self._send_cmd(Command().press(button).hold(hold_time))
-        self._send_cmd(Command().hold(wait_time))
+        await self._send(
+            self._send_cmds(Command.NEUTRAL.press(button).hold(hold_time), Command.NEUTRAL.hold(wait_time))
+        )
         # self.controller.p_wait((hold_time + wait_time) / 1000.0)
         await self.controller.wait_for_inputs()
 
@@ -116,33 +242,56 @@ class Script:
         size: Tuple[int, int],
         timeout: Optional[float],
         invert: bool = True,
+        min_confidence: Optional[float] = None,
     ) -> bool:
         start_time = time.time()
+        detector = change_detection.ChangeDetector([(top_left, size)])
+        seq = 0
         while timeout is None or start_time + timeout > time.time():
-            ocr_text = image_processing.run_tesseract_line(image_processing.capture(), top_left, size, invert)
-            if matcher(ocr_text):
+            # Wakes as soon as the region changes, the text can't have started matching while it didn't
+            try:
+                # The frame may be a view into the frame bus that is overwritten while the regions are OCRed
+                frame, _ = await run_blocking(
+                    change_detection.wait_for_change, detector, seq, remaining(start_time, timeout), True
+                )
+            except TimeoutError:
+                break
+            seq = frame.seq
+            ocr_text = await read_line(frame.image, top_left, size, invert, min_confidence)
+            if ocr_text is not None and matcher(ocr_text):
                 return True
-            await asyncio.sleep(0.1)
         return False
 
     @staticmethod
-    async def match(*matchers: MatchArgs) -> Optional[Tuple[int, Optional[str]]]:
-        frame = image_processing.capture()
-        for matcher, run_func, top_left, size, invert in matchers:
-            ocr_text = image_processing.run_tesseract_line(frame, top_left, size, invert)
-            if matcher(ocr_text):
-                return await run_func()
+    async def match(
+        *matchers: MatchArgs, min_confidence: Optional[float] = None
+    ) -> Optional[Tuple[int, Optional[str]]]:
+        frame = await run_blocking(_capture_regions, [(top_left, size) for _, _, top_left, size, _ in matchers])
+        index = await first_match(frame, matchers, min_confidence)
+        if index is not None:
+            return await matchers[index][1]()
 
         return None
 
     @staticmethod
-    async def wait_for_match(*matchers: MatchArgs, timeout: Optional[float]) -> Tuple[int, Optional[str]]:
+    async def wait_for_match(
+        *matchers: MatchArgs, timeout: Optional[float], min_confidence: Optional[float] = None
+    ) -> Tuple[int, Optional[str]]:
         start_time = time.time()
+        detector = change_detection.ChangeDetector([(top_left, size) for _, _, top_left, size, _ in matchers])
+        seq = 0
         while timeout is None or start_time + timeout > time.time():
-            frame = image_processing.capture()
-            for matcher, run_func, top_left, size, invert in matchers:
-                ocr_text = image_processing.run_tesseract_line(frame, top_left, size, invert)
-                if matcher(ocr_text):
-                    return await run_func()
-            await asyncio.sleep(0.1)
+            try:
+                # The frame may be a view into the frame bus that is overwritten while the regions are OCRed
+                frame, changed = await run_blocking(
+                    change_detection.wait_for_change, detector, seq, remaining(start_time, timeout), True
+                )
+            except TimeoutError:
+                break
+            seq = frame.seq
+            # Regions that didn't change (or settle) didn't match last time either, so only the others are OCRed again
+            candidates = [index for index, is_changed in enumerate(changed) if is_changed]
+            index = await first_match(frame.image, [matchers[index] for index in candidates], min_confidence)
+            if index is not None:
+                return await matchers[candidates[index]][1]()
         raise TimeoutError("Did not match within timeout")
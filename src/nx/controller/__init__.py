@@ -1 +1,9 @@
-from .controller import Button, Command, Controller, DPad, LeftStick, RightStick
+from .controller import (
+    AsyncController,
+    Button,
+    Command,
+    Controller,
+    DPad,
+    LeftStick,
+    RightStick,
+)
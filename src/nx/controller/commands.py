@@ -4,6 +4,13 @@ from enum import IntEnum
 class ControllerRequest(IntEnum):
     UPDATE_REPORT = 0x00
     UPDATE_REPORT_FOR_MSEC = 0x01
+    # 2 byte entry count followed by that many (8 byte report, 4 byte duration in msec) entries
+    UPDATE_REPORT_BATCH = 0x02
+    # 1 byte priority of the connection, used when the server arbitrates between clients by priority
+    SET_PRIORITY = 0x03
+    # Wraps another request with a 2 byte sequence number so that several requests can be in flight at once.
+    # Responses to a sequenced request are followed by the same sequence number.
+    SEQUENCED = 0x80
     STOP = 0xFF
 
     def serialize(self):
@@ -19,3 +26,13 @@ class ControllerResponse(IntEnum):
 
     def serialize(self):
         return self.value.to_bytes(1, byteorder="little", signed=False)
+
+
+REPORT_BYTES = 8
+DURATION_BYTES = 4
+BATCH_COUNT_BYTES = 2
+BATCH_ENTRY_BYTES = REPORT_BYTES + DURATION_BYTES
+MAX_BATCH_ENTRIES = (1 << (8 * BATCH_COUNT_BYTES)) - 1
+
+SEQUENCE_NUMBER_BYTES = 2
+SEQUENCE_NUMBER_MASK = (1 << (8 * SEQUENCE_NUMBER_BYTES)) - 1
@@ -1,9 +1,10 @@
 import asyncio
 import math
+import struct
 import time
-from typing import List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .commands import ControllerRequest
+from .commands import MAX_BATCH_ENTRIES, ControllerRequest
 from .raw_inputs import ExtendedIntFlagEnum, RawButton, RawDPad, _RawDPad
 
 Button = RawButton
@@ -58,33 +59,126 @@ class RightStick(_AnalogStick):
     SHIFT_BITS = 16
 
 
+# Buttons (little endian), hat switch, left x/y, right x/y and a padding byte
+PACKET_FORMAT = struct.Struct("<HBBBBBx")
+# A packet followed by how long to hold it in msec, as sent in UPDATE_REPORT_FOR_MSEC and UPDATE_REPORT_BATCH
+TIMED_PACKET_FORMAT = struct.Struct("<HBBBBBxI")
+BATCH_COUNT_FORMAT = struct.Struct("<H")
+
+# noinspection PyTypeChecker
+_DPAD_TO_RAW = {dpad.value: getattr(RawDPad, dpad.name) >> _RawDPad.SHIFT_BITS for dpad in DPad.__members__.values()}
+
+_STICK_ANGLES = 360
+_STICK_INTENSITIES = 0x100
+# Per angle, the stick x and y for every intensity. Rows are filled in the first time an angle is used.
+_STICK_X_ROWS: List[Optional[bytes]] = [None] * _STICK_ANGLES
+_STICK_Y_ROWS: List[Optional[bytes]] = [None] * _STICK_ANGLES
+
+
+def _compute_stick_rows(angle: int) -> None:
+    cos = math.cos(math.radians(angle)) * 0x7F
+    sin = math.sin(math.radians(angle)) * 0x7F
+    # y is negative because on the Y input, UP = 0 and DOWN = 255
+    _STICK_X_ROWS[angle] = bytes(int(cos * intensity / 0xFF) + 0x80 for intensity in range(_STICK_INTENSITIES))
+    _STICK_Y_ROWS[angle] = bytes(-int(sin * intensity / 0xFF) + 0x80 for intensity in range(_STICK_INTENSITIES))
+
+
+# Builder results are interned up to this many distinct commands, so that scripts reusing the same inputs get the
+# same instance back, along with its already encoded packet
+_INTERN_LIMIT = 4096
+# Passed to Command._replace for fields that keep their value, since None is a valid hold time
+_KEEP: Any = object()
+
+
 class Command:
-    def __init__(self):
-        self._buttons = 0
-        self._dpad = DPad.Center
-        self._stick_angle = 0
-        self._stick_intensity = 0
-        self.time = 0
+    """
+    An immutable controller state and how long to hold it for.
+
+    Builder methods return a new Command rather than modifying this one, so commands can be shared and reused
+    freely. Commands are hashable and compare by value, the common ones are interned, and each instance only
+    encodes its packet once. Every button and D-pad direction is available on its own as e.g. Command.A and
+    Command.Up, and Command.NEUTRAL has nothing pressed.
+    """
+
+    __slots__ = ("_buttons", "_dpad", "_stick_angle", "_stick_intensity", "time", "_fields", "_packet")
+
+    _interned: Dict[Tuple[int, int, int, int, int], "Command"] = {}
+
+    def __init__(
+        self,
+        buttons: int = 0,
+        dpad: DPad = DPad.Center,
+        stick_angle: int = 0,
+        stick_intensity: int = 0,
+        time: int = 0,
+    ):
+        object.__setattr__(self, "_buttons", buttons)
+        object.__setattr__(self, "_dpad", dpad)
+        object.__setattr__(self, "_stick_angle", stick_angle)
+        object.__setattr__(self, "_stick_intensity", stick_intensity)
+        object.__setattr__(self, "time", time)
+        object.__setattr__(self, "_fields", None)
+        object.__setattr__(self, "_packet", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _key(self) -> Tuple[int, int, int, int, int]:
+        return self._buttons, self._dpad, self._stick_angle, self._stick_intensity, self.time
+
+    def __eq__(self, other):
+        if not isinstance(other, Command):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return (
+            f"Command(buttons={self._buttons!r}, dpad={self._dpad!r}, stick_angle={self._stick_angle!r}, "
+            f"stick_intensity={self._stick_intensity!r}, time={self.time!r})"
+        )
+
+    def __reduce__(self):
+        return Command, self._key()
+
+    def _replace(self, buttons=_KEEP, dpad=_KEEP, stick_angle=_KEEP, stick_intensity=_KEEP, time=_KEEP) -> "Command":
+        key = (
+            self._buttons if buttons is _KEEP else buttons,
+            self._dpad if dpad is _KEEP else dpad,
+            self._stick_angle if stick_angle is _KEEP else stick_angle,
+            self._stick_intensity if stick_intensity is _KEEP else stick_intensity,
+            self.time if time is _KEEP else time,
+        )
+        command = Command._interned.get(key)
+        if command is None:
+            command = Command(*key)
+            if key[:4] == self._key()[:4]:
+                # Only the hold time changed, so the packet is the same
+                object.__setattr__(command, "_fields", self._fields)
+                object.__setattr__(command, "_packet", self._packet)
+            if len(Command._interned) < _INTERN_LIMIT:
+                Command._interned[key] = command
+        return command
 
     def press(self, button: Button) -> "Command":
-        self._buttons |= button
-        return self
+        return self._replace(buttons=self._buttons | button)
 
     def release(self, button: Button) -> "Command":
-        self._buttons &= ~(1 << button)
-        return self
+        return self._replace(buttons=self._buttons & ~button)
 
     def dpad(self, dpad: DPad) -> "Command":
-        self._dpad = dpad
-        return self
+        return self._replace(dpad=dpad)
 
     def stick_angle(self, angle) -> "Command":
-        self._stick_angle = angle
-        return self
+        return self._replace(stick_angle=angle)
 
     def stick_value(self, value) -> "Command":
-        self._stick_intensity = value
-        return self
+        return self._replace(stick_intensity=value)
 
     def left_angle(self, angle) -> "Command":
         return self.stick_angle(angle << LeftStick.SHIFT_BITS)
@@ -98,9 +192,8 @@ class Command:
     def right_value(self, value) -> "Command":
         return self.stick_value(value << RightStick.SHIFT_BITS)
 
-    def hold(self, value: int) -> "Command":
-        self.time = value
-        return self
+    def hold(self, value: Optional[int]) -> "Command":
+        return self._replace(time=value)
 
     # noinspection PyTypeChecker
     @property
@@ -124,36 +217,68 @@ class Command:
         return (self._stick_angle >> 16) & 0xFFFF, (self._stick_intensity >> 16) & 0xFFFF
 
     def _translate_dpad(self):
-        # ew
-        # noinspection PyTypeChecker
-        return getattr(RawDPad, DPad(self._dpad).name) >> _RawDPad.SHIFT_BITS
+        return _DPAD_TO_RAW[self._dpad]
 
     @staticmethod
     # Compute x and y based on angle and intensity
     def _translate_angle(angle, intensity):
+        if isinstance(angle, int) and 0 <= intensity < _STICK_INTENSITIES:
+            # Whole angles are periodic, so one turn of lookup tables covers all of them
+            angle %= _STICK_ANGLES
+            x_row = _STICK_X_ROWS[angle]
+            if x_row is None:
+                _compute_stick_rows(angle)
+                x_row = _STICK_X_ROWS[angle]
+            return x_row[intensity], _STICK_Y_ROWS[angle][intensity]
+
         # y is negative because on the Y input, UP = 0 and DOWN = 255
         x = int((math.cos(math.radians(angle)) * 0x7F) * intensity / 0xFF) + 0x80
         y = -int((math.sin(math.radians(angle)) * 0x7F) * intensity / 0xFF) + 0x80
         return x, y
 
+    def _packet_fields(self) -> Tuple[int, int, int, int, int, int]:
+        fields = self._fields
+        if fields is None:
+            left_x, left_y = self._translate_angle(self._stick_angle & 0xFFFF, self._stick_intensity & 0xFFFF)
+            right_x, right_y = self._translate_angle(
+                (self._stick_angle >> 16) & 0xFFFF, (self._stick_intensity >> 16) & 0xFFFF
+            )
+            fields = self._buttons & 0xFFFF, self._translate_dpad(), left_x, left_y, right_x, right_y
+            object.__setattr__(self, "_fields", fields)
+        return fields
+
     def to_packet(self):
-        button_low = self._buttons & 0xFF
-        button_high = (self._buttons >> 8) & 0xFF
-        dpad = self._translate_dpad()
+        return list(self.to_bytes())
 
-        left_angle, left_intensity = self.current_left_stick
-        right_angle, right_intensity = self.current_right_stick
+    def to_bytes(self) -> bytes:
+        packet = self._packet
+        if packet is None:
+            packet = PACKET_FORMAT.pack(*self._packet_fields())
+            object.__setattr__(self, "_packet", packet)
+        return packet
 
-        left_x, left_y = self._translate_angle(left_angle, left_intensity)
-        right_x, right_y = self._translate_angle(right_angle, right_intensity)
+    def pack_into(self, buffer: bytearray, offset: int = 0) -> None:
+        buffer[offset : offset + PACKET_FORMAT.size] = self.to_bytes()
 
-        packet = [button_low, button_high, dpad, left_x, left_y, right_x, right_y, 0x00]
-        return packet
+    def pack_timed_into(self, buffer: bytearray, offset: int = 0) -> None:
+        TIMED_PACKET_FORMAT.pack_into(buffer, offset, *self._packet_fields(), self.time or 0)
 
     def copy(self):
-        c = Command()
-        c.__dict__ = self.__dict__.copy()
-        return c
+        # Commands are immutable, so there is nothing to copy
+        return self
+
+
+Command.NEUTRAL = Command()
+# So that builders that end up with nothing pressed return this very instance
+Command._interned[Command.NEUTRAL._key()] = Command.NEUTRAL
+# noinspection PyTypeChecker
+for _button in Button.__members__.values():
+    if _button != Button.Nothing:
+        setattr(Command, _button.name, Command.NEUTRAL.press(_button))
+for _dpad in DPad.__members__.values():
+    if _dpad != DPad.Center:
+        setattr(Command, _dpad.name, Command.NEUTRAL.dpad(_dpad))
+del _button, _dpad
 
 
 class Controller:
@@ -183,33 +308,109 @@ class Controller:
         ry = int.from_bytes(bytestring[6:7], byteorder="little")
         print(f"Buttons: {button}, DPad: {dpad}, LX: {lx}, LY: {ly}, RX: {rx}, RY: {ry}")
 
-    # Send a formatted controller command to the MCU
-    def send_cmd(self, command: Optional[Command] = None):
-        if command is None:
-            command = Command()
-
+    def _update_finish_time(self, command: Command):
         if command.time is not None and command.time > 0:
-            self.output.write(
-                ControllerRequest.UPDATE_REPORT_FOR_MSEC,
-                bytes(command.to_packet()) + command.time.to_bytes(length=4, byteorder="little"),
-            )
             if self.last_input_finish_time is None:
                 self.last_input_finish_time = time.time()
             self.last_input_finish_time = max(self.last_input_finish_time, time.time()) + (command.time / 1000)
         else:
-            self.output.write(ControllerRequest.UPDATE_REPORT, bytes(command.to_packet()))
             self.last_input_finish_time = time.time()
 
+    @staticmethod
+    def _encode_cmd(command: Command) -> Tuple[ControllerRequest, bytes]:
+        if command.time is not None and command.time > 0:
+            return ControllerRequest.UPDATE_REPORT_FOR_MSEC, TIMED_PACKET_FORMAT.pack(
+                *command._packet_fields(), command.time
+            )
+        return ControllerRequest.UPDATE_REPORT, command.to_bytes()
+
+    @staticmethod
+    def _encode_batches(commands: List[Command]) -> Iterator[Tuple[List[Command], bytes]]:
+        for start in range(0, len(commands), MAX_BATCH_ENTRIES):
+            chunk = commands[start : start + MAX_BATCH_ENTRIES]
+            data = bytearray(BATCH_COUNT_FORMAT.size + len(chunk) * TIMED_PACKET_FORMAT.size)
+            BATCH_COUNT_FORMAT.pack_into(data, 0, len(chunk))
+            offset = BATCH_COUNT_FORMAT.size
+            for command in chunk:
+                command.pack_timed_into(data, offset)
+                offset += TIMED_PACKET_FORMAT.size
+            yield chunk, bytes(data)
+
+    # Send a formatted controller command to the MCU
+    def send_cmd(self, command: Optional[Command] = None):
+        if command is None:
+            command = Command.NEUTRAL
+
+        self.output.write(*self._encode_cmd(command))
+        self._update_finish_time(command)
+
+    # Send a whole timeline of commands in as few messages as possible.
+    # Commands without a hold time are held until the next command in the batch.
+    def send_cmds(self, commands: Iterable[Command]):
+        commands = list(commands)
+        if not getattr(self.output, "supports_batch", False):
+            for command in commands:
+                self.send_cmd(command)
+            return
+
+        for chunk, data in self._encode_batches(commands):
+            self.output.write(ControllerRequest.UPDATE_REPORT_BATCH, data)
+            for command in chunk:
+                self._update_finish_time(command)
+
+    # Only used by servers that arbitrate between several clients by priority, higher wins
+    def set_priority(self, priority: int):
+        self.output.write(ControllerRequest.SET_PRIORITY, priority.to_bytes(1, byteorder="little"))
+
     def press_button(self, button: Button, hold_ms: int = 80, wait_ms: int = None) -> "Controller":
         if wait_ms is None:
             wait_ms = hold_ms
-        self.send_cmd(Command().press(button).hold(hold_ms))
-        self.send_cmd(Command().hold(wait_ms))
+        self.send_cmds([Command.NEUTRAL.press(button).hold(hold_ms), Command.NEUTRAL.hold(wait_ms)])
         return self
 
     def press_dpad(self, dpad: DPad, hold_ms: int = 80, wait_ms: int = None) -> "Controller":
         if wait_ms is None:
             wait_ms = hold_ms
-        self.send_cmd(Command().dpad(dpad).hold(hold_ms))
-        self.send_cmd(Command().hold(wait_ms))
+        self.send_cmds([Command.NEUTRAL.dpad(dpad).hold(hold_ms), Command.NEUTRAL.hold(wait_ms)])
+        return self
+
+
+class AsyncController(Controller):
+    """
+    Controller for sinks whose write() is a coroutine, such as AsyncSocketSink.
+    Sending a command yields to the event loop instead of blocking it while waiting for the server.
+    """
+
+    async def send_cmd(self, command: Optional[Command] = None):
+        if command is None:
+            command = Command.NEUTRAL
+
+        await self.output.write(*self._encode_cmd(command))
+        self._update_finish_time(command)
+
+    async def send_cmds(self, commands: Iterable[Command]):
+        commands = list(commands)
+        if not getattr(self.output, "supports_batch", False):
+            for command in commands:
+                await self.send_cmd(command)
+            return
+
+        for chunk, data in self._encode_batches(commands):
+            await self.output.write(ControllerRequest.UPDATE_REPORT_BATCH, data)
+            for command in chunk:
+                self._update_finish_time(command)
+
+    async def set_priority(self, priority: int):
+        await self.output.write(ControllerRequest.SET_PRIORITY, priority.to_bytes(1, byteorder="little"))
+
+    async def press_button(self, button: Button, hold_ms: int = 80, wait_ms: int = None) -> "AsyncController":
+        if wait_ms is None:
+            wait_ms = hold_ms
+        await self.send_cmds([Command.NEUTRAL.press(button).hold(hold_ms), Command.NEUTRAL.hold(wait_ms)])
+        return self
+
+    async def press_dpad(self, dpad: DPad, hold_ms: int = 80, wait_ms: int = None) -> "AsyncController":
+        if wait_ms is None:
+            wait_ms = hold_ms
+        await self.send_cmds([Command.NEUTRAL.dpad(dpad).hold(hold_ms), Command.NEUTRAL.hold(wait_ms)])
         return self
@@ -0,0 +1,404 @@
+import selectors
+import signal
+import socket
+import struct
+import threading
+import time
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from .commands import (
+    REPORT_BYTES,
+    SEQUENCE_NUMBER_BYTES,
+    ControllerRequest,
+    ControllerResponse,
+)
+from .frame_parser import NOT_SEQUENCED, FrameParser, UnknownRequestError
+from .raw_inputs import EMPTY_REPORT
+from .report_scheduler import ReportScheduler, ScheduledReport, duration_ns_for_msec
+from .server_stats import ServerStats
+
+DEFAULT_LISTEN_ADDRESS = ("0.0.0.0", 3000)
+# Clients holding the exclusive lock lose it after this long without a request, so a stale connection
+# doesn't lock everybody else out until its EOF finally arrives
+DEFAULT_IDLE_TIMEOUT_S = 30.0
+# How often held requests are retried while waiting for room in a queue or for the exclusive lock
+RETRY_INTERVAL_S = 0.005
+# A client that doesn't read its responses for this long is disconnected instead of stalling the other clients
+SEND_TIMEOUT_S = 1.0
+
+# Byte offsets of the report fields, see REPORT_DESCRIPTOR
+DPAD_OFFSET = 2
+LEFT_STICK_OFFSET = 3
+RIGHT_STICK_OFFSET = 5
+DPAD_CENTER = EMPTY_REPORT[DPAD_OFFSET]
+STICK_CENTER = EMPTY_REPORT[LEFT_STICK_OFFSET : LEFT_STICK_OFFSET + 2]
+
+# (8 byte report, duration in msec) of UPDATE_REPORT_FOR_MSEC and of every UPDATE_REPORT_BATCH entry
+REPORT_ENTRY_FORMAT = struct.Struct(f"<{REPORT_BYTES}sI")
+
+
+class ArbitrationPolicy(Enum):
+    # One client at a time has control, the others are held until it disconnects or goes idle
+    EXCLUSIVE = "exclusive"
+    # Every client is accepted, and each poll the highest priority client that has input in flight wins
+    PRIORITY = "priority"
+    # Buttons of all clients are combined, and the dpad and each stick go to the first client that moves them
+    MERGE = "merge"
+
+
+def parse_reports(request: int, buffer: bytearray, offset: int, num_bytes: int) -> List[ScheduledReport]:
+    """Copy the reports of an update request out of the receive buffer."""
+    if request == ControllerRequest.UPDATE_REPORT:
+        return [(bytes(buffer[offset : offset + REPORT_BYTES]), None)]
+    elif request == ControllerRequest.UPDATE_REPORT_FOR_MSEC:
+        report, duration_ms = REPORT_ENTRY_FORMAT.unpack_from(buffer, offset)
+        return [(report, duration_ns_for_msec(duration_ms))]
+
+    # A duration of 0 holds the report until the next one, like UPDATE_REPORT
+    return [
+        (report, duration_ns_for_msec(duration_ms) if duration_ms > 0 else None)
+        for report, duration_ms in REPORT_ENTRY_FORMAT.iter_unpack(memoryview(buffer)[offset : offset + num_bytes])
+    ]
+
+
+def merge_reports(reports: List[bytearray], buffer: bytearray) -> None:
+    buffer[:] = EMPTY_REPORT
+    buttons = 0
+    dpad_set = left_set = right_set = False
+    for report in reports:
+        buttons |= report[0] | (report[1] << 8)
+        if not dpad_set and report[DPAD_OFFSET] != DPAD_CENTER:
+            buffer[DPAD_OFFSET] = report[DPAD_OFFSET]
+            dpad_set = True
+        if not left_set and report[LEFT_STICK_OFFSET : LEFT_STICK_OFFSET + 2] != STICK_CENTER:
+            buffer[LEFT_STICK_OFFSET : LEFT_STICK_OFFSET + 2] = report[LEFT_STICK_OFFSET : LEFT_STICK_OFFSET + 2]
+            left_set = True
+        if not right_set and report[RIGHT_STICK_OFFSET : RIGHT_STICK_OFFSET + 2] != STICK_CENTER:
+            buffer[RIGHT_STICK_OFFSET : RIGHT_STICK_OFFSET + 2] = report[RIGHT_STICK_OFFSET : RIGHT_STICK_OFFSET + 2]
+            right_set = True
+    buffer[0] = buttons & 0xFF
+    buffer[1] = buttons >> 8
+
+
+class HeldRequest:
+    """A request that can't be queued yet, because of a user override, the exclusive lock or a full queue."""
+
+    def __init__(self, reports: List[ScheduledReport], seq_bytes: bytes, received_at: int):
+        self.reports = reports
+        self.seq_bytes = seq_bytes
+        self.received_at = received_at
+        # When the client was told about the hold with USER_OVERRIDE, None if it wasn't
+        self.held_since: Optional[int] = None
+
+
+class ClientConnection:
+    def __init__(self, conn: socket.socket, addr, stats: ServerStats):
+        self.conn = conn
+        self.addr = addr
+        # Every client gets its own queue, so that one client's timeline can't delay another's
+        self.scheduler = ReportScheduler(stats=stats)
+        # The report this client wants sent at the current poll
+        self.report = bytearray(EMPTY_REPORT)
+        self.priority = 0
+        self.last_active = time.monotonic()
+        self.parser = FrameParser()
+        # Requests are handled in order, so nothing else is read from the client while one is held
+        self.held: Optional[HeldRequest] = None
+        self.greeted = False
+        self.registered = False
+        self.closed = False
+
+    def is_drained(self) -> bool:
+        return len(self.scheduler.queue) == 0 and self.scheduler.current_deadline is None
+
+    def is_idle(self, now: float, idle_timeout: float) -> bool:
+        if self.closed:
+            return self.is_drained()
+        # A client still playing back what it queued, e.g. while it waits on a slow OCR, isn't idle
+        return self.held is None and self.is_drained() and now - self.last_active > idle_timeout
+
+    def has_input(self) -> bool:
+        return self.scheduler.current_deadline is not None or self.report != EMPTY_REPORT
+
+
+class ControllerServer:
+    """
+    Accepts any number of client connections on one thread and arbitrates between them.
+
+    Every client has its own ReportScheduler. On every USB poll fill_report() advances all of them and combines
+    their reports according to the arbitration policy. Requests that can't be queued yet are held with
+    USER_OVERRIDE, and HOST_ENABLED is sent once they can be, like during a user override.
+    """
+
+    def __init__(
+        self,
+        listen_address: Tuple[str, int] = DEFAULT_LISTEN_ADDRESS,
+        policy: ArbitrationPolicy = ArbitrationPolicy.EXCLUSIVE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT_S,
+        stats: Optional[ServerStats] = None,
+    ):
+        self.listen_address = listen_address
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        self.stats = stats if stats is not None else ServerStats()
+
+        self.selector = selectors.DefaultSelector()
+        self.clients: Dict[socket.socket, ClientConnection] = {}
+        # Disconnected clients whose queued reports are still being sent, like they were by the single client server
+        self.draining: List[ClientConnection] = []
+        # Replaced rather than modified, so the USB thread can iterate it without a lock
+        self.active_clients: Tuple[ClientConnection, ...] = ()
+        self.owner: Optional[ClientConnection] = None
+
+        self._lock = threading.Lock()
+        self.host_enabled = False
+        self.user_override = False
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+
+    def wake(self) -> None:
+        try:
+            self._wakeup_send.send(b"\x00")
+        except BlockingIOError:
+            pass
+
+    def set_host_enabled(self, enabled: bool) -> None:
+        self.host_enabled = enabled
+        self.wake()
+
+    def set_user_override(self, user_override: bool) -> None:
+        with self._lock:
+            self.user_override = user_override
+            if user_override:
+                for client in self.active_clients:
+                    client.scheduler.clear()
+        self.wake()
+
+    def fill_report(self, buffer: bytearray, now: int, poll_interval_ns: float) -> None:
+        """Copy the report that is due at now into buffer. Called from the USB thread on every poll."""
+        if self.policy == ArbitrationPolicy.EXCLUSIVE:
+            owner = self.owner
+            if owner is None:
+                buffer[:] = EMPTY_REPORT
+                return
+            owner.scheduler.poll_interval_ns = poll_interval_ns
+            owner.scheduler.fill_report(buffer, now)
+            return
+
+        clients = self.active_clients
+        # Every client's timeline keeps running, even while another client's input wins
+        for client in clients:
+            client.scheduler.poll_interval_ns = poll_interval_ns
+            client.scheduler.fill_report(client.report, now)
+
+        if self.policy == ArbitrationPolicy.PRIORITY:
+            best = None
+            for client in clients:
+                if client.has_input() and (best is None or client.priority > best.priority):
+                    best = client
+            buffer[:] = best.report if best is not None else EMPTY_REPORT
+        else:
+            merge_reports([client.report for client in clients], buffer)
+
+    @staticmethod
+    def seq_bytes(seq: int) -> bytes:
+        return b"" if seq == NOT_SEQUENCED else seq.to_bytes(SEQUENCE_NUMBER_BYTES, byteorder="little")
+
+    @staticmethod
+    def send_response(client: ClientConnection, response_header: ControllerResponse, response_body: bytes = b""):
+        client.conn.sendall(response_header.serialize() + response_body)
+
+    def _has_control(self, client: ClientConnection) -> bool:
+        if self.policy != ArbitrationPolicy.EXCLUSIVE:
+            return True
+        owner = self.owner
+        if owner is not client and (owner is None or owner.is_idle(time.monotonic(), self.idle_timeout)):
+            if owner is not None:
+                print(f"Taking exclusive control away from idle client {owner.addr}")
+                owner.scheduler.clear()
+            print(f"Client {client.addr} has exclusive control")
+            self.owner = owner = client
+        return owner is client
+
+    def _try_queue(self, client: ClientConnection) -> None:
+        held = client.held
+        with self._lock:
+            blocked = self.user_override or not self._has_control(client)
+            if not blocked and not held.seq_bytes and held.held_since is not None:
+                # Unsequenced clients resend the request once they are unblocked
+                queued = None
+            elif not blocked and client.scheduler.has_room_for(len(held.reports)):
+                queued = client.scheduler.add_reports(held.reports)
+            else:
+                queued = False
+
+        if blocked:
+            if held.held_since is None:
+                print(f"Holding request from {client.addr} until it can take control")
+                self.send_response(client, ControllerResponse.USER_OVERRIDE, held.seq_bytes)
+                held.held_since = time.monotonic_ns()
+            return
+
+        if held.held_since is not None:
+            print(f"Unblocking client {client.addr}")
+            self.send_response(client, ControllerResponse.HOST_ENABLED, held.seq_bytes)
+            self.stats.user_override_us.record((time.monotonic_ns() - held.held_since) // 1000)
+            held.held_since = None
+        if queued is None:
+            client.held = None
+        elif queued:
+            # Sequenced clients keep requests in flight, so a held request is queued as soon as it can be
+            client.held = None
+            self.stats.reports_queued.increment(len(held.reports))
+            self.stats.queue_depth.record(len(client.scheduler.queue))
+            self.stats.recv_to_queue_us.record((time.monotonic_ns() - held.received_at) // 1000)
+            self.send_response(client, ControllerResponse.ACK, held.seq_bytes)
+        # Otherwise the queue is full, which applies backpressure until the USB host has drained enough of it
+
+    def _handle_requests(self, client: ClientConnection) -> bool:
+        """Handle every complete request in the client's buffer, returns False if the client should be closed."""
+        parser = client.parser
+        while client.held is None:
+            try:
+                if not parser.next_frame():
+                    return True
+            except UnknownRequestError as e:
+                print(f"Closing connection from {client.addr} because of unknown request: {e}")
+                self.send_response(client, ControllerResponse.NACK, self.seq_bytes(e.seq))
+                return False
+
+            request = parser.request
+            client.last_active = time.monotonic()
+            if (
+                request == ControllerRequest.UPDATE_REPORT
+                or request == ControllerRequest.UPDATE_REPORT_FOR_MSEC
+                or request == ControllerRequest.UPDATE_REPORT_BATCH
+            ):
+                self.stats.requests_received.increment()
+                reports = parse_reports(request, parser.buffer, parser.payload_offset, parser.payload_bytes)
+                client.held = HeldRequest(reports, self.seq_bytes(parser.seq), time.monotonic_ns())
+                self._try_queue(client)
+            elif request == ControllerRequest.SET_PRIORITY:
+                client.priority = parser.buffer[parser.payload_offset]
+                self.send_response(client, ControllerResponse.ACK, self.seq_bytes(parser.seq))
+            elif request == ControllerRequest.STOP:
+                print(f"Stop requested")
+                signal.raise_signal(signal.SIGINT)
+                return False
+            else:
+                self.send_response(client, ControllerResponse.NACK, self.seq_bytes(parser.seq))
+        return True
+
+    def _accept(self, sock: socket.socket) -> None:
+        conn, addr = sock.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Notice clients that vanished without closing their connection
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        conn.settimeout(SEND_TIMEOUT_S)
+        print(f"Accepting socket connection from {addr}: {conn}")
+        client = ClientConnection(conn, addr, self.stats)
+        self.clients[conn] = client
+        self._update_active_clients()
+
+    def _update_active_clients(self) -> None:
+        self.active_clients = tuple(self.clients.values()) + tuple(self.draining)
+
+    def _close(self, client: ClientConnection) -> None:
+        print(f"Closing connection from {client.addr}")
+        if client.registered:
+            self.selector.unregister(client.conn)
+        client.conn.close()
+        client.closed = True
+        del self.clients[client.conn]
+        if not client.is_drained():
+            self.draining.append(client)
+        elif self.owner is client:
+            self.owner = None
+        self._update_active_clients()
+
+    def _remove_drained(self) -> None:
+        drained = [client for client in self.draining if client.is_drained()]
+        if not drained:
+            return
+        for client in drained:
+            self.draining.remove(client)
+            if self.owner is client:
+                self.owner = None
+        self._update_active_clients()
+
+    def _update_registration(self, client: ClientConnection) -> None:
+        # Held clients aren't read from, so that their socket buffers fill up and they block
+        should_register = client.greeted and client.held is None
+        if should_register and not client.registered:
+            self.selector.register(client.conn, selectors.EVENT_READ, client)
+        elif client.registered and not should_register:
+            self.selector.unregister(client.conn)
+        client.registered = should_register
+
+    def _service(self, client: ClientConnection, readable: bool) -> None:
+        try:
+            if not client.greeted:
+                if not self.host_enabled:
+                    return
+                print(f"USB host enabled endpoint, unblocking client {client.addr}")
+                self.send_response(client, ControllerResponse.HOST_ENABLED)
+                client.greeted = True
+            if client.held is not None:
+                self._try_queue(client)
+            if readable:
+                if client.parser.recv_from(client.conn) == 0:
+                    print(f"EOF from {client.addr}")
+                    self._close(client)
+                    return
+            if not self._handle_requests(client):
+                self._close(client)
+                return
+        except OSError as e:
+            # Includes timeouts of clients that stopped reading their responses
+            print(f"Connection to {client.addr} failed: {e!r}")
+            self._close(client)
+            return
+        self._update_registration(client)
+
+    def serve_forever(self) -> None:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self.listen_address)
+        sock.listen()
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        print(f"Listening on {self.listen_address[0]}:{self.listen_address[1]} with {self.policy.value} arbitration")
+
+        try:
+            while True:
+                self._remove_drained()
+                waiting = self.draining or any(
+                    client.held is not None or not client.greeted for client in self.clients.values()
+                )
+                readable = set()
+                for key, _ in self.selector.select(RETRY_INTERVAL_S if waiting else None):
+                    if key.fileobj is sock:
+                        self._accept(sock)
+                    elif key.fileobj is self._wakeup_recv:
+                        while True:
+                            try:
+                                self._wakeup_recv.recv(4096)
+                            except BlockingIOError:
+                                break
+                    else:
+                        readable.add(key.data)
+
+                # Clients that weren't readable may still be waiting for the host, the lock or room in their queue
+                for client in list(self.clients.values()):
+                    if client in readable or client.held is not None or not client.greeted:
+                        self._service(client, client in readable)
+        finally:
+            for client in list(self.clients.values()):
+                self._close(client)
+            self.draining.clear()
+            self._update_active_clients()
+            self.selector.close()
+            sock.close()
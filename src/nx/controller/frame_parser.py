@@ -0,0 +1,133 @@
+import socket
+from typing import List, Optional
+
+from .commands import (
+    BATCH_COUNT_BYTES,
+    BATCH_ENTRY_BYTES,
+    DURATION_BYTES,
+    REPORT_BYTES,
+    SEQUENCE_NUMBER_BYTES,
+    ControllerRequest,
+)
+
+# Large enough for hundreds of pipelined requests, bigger batches grow the buffer as needed
+DEFAULT_BUFFER_BYTES = 64 * 1024
+
+NOT_SEQUENCED = -1
+
+# Bytes that follow each request byte, None for requests the server doesn't know
+PAYLOAD_BYTES: List[Optional[int]] = [None] * 256
+PAYLOAD_BYTES[ControllerRequest.UPDATE_REPORT] = REPORT_BYTES
+PAYLOAD_BYTES[ControllerRequest.UPDATE_REPORT_FOR_MSEC] = REPORT_BYTES + DURATION_BYTES
+# Only the entry count, followed by the entries themselves
+PAYLOAD_BYTES[ControllerRequest.UPDATE_REPORT_BATCH] = BATCH_COUNT_BYTES
+PAYLOAD_BYTES[ControllerRequest.SET_PRIORITY] = 1
+PAYLOAD_BYTES[ControllerRequest.STOP] = 0
+
+SEQUENCED_HEADER_BYTES = 1 + SEQUENCE_NUMBER_BYTES
+
+
+class UnknownRequestError(ValueError):
+    """The length of an unknown request can't be known, so the stream can't be resynced after one."""
+
+    def __init__(self, request: int, seq: int):
+        super().__init__(f"Unknown request: {request:#04x}")
+        self.request = request
+        self.seq = seq
+
+
+class FrameParser:
+    """
+    Receives a client's requests into one preallocated buffer and decodes them where they are.
+
+    recv_from() reads as much as the socket has buffered with a single recv_into(), and next_frame() is then called
+    until it returns False to decode every complete request in it. The decoded request is described by attributes
+    rather than returned, and its payload is read from buffer at payload_offset, so decoding doesn't allocate.
+    Bytes of an incomplete request are moved to the front of the buffer before the next read.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_BUFFER_BYTES):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        # Received bytes that haven't been decoded yet are buffer[start:end]
+        self.start = 0
+        self.end = 0
+        # Size of the incomplete request at start, once its header has been received
+        self.frame_bytes = 1
+
+        # The request decoded by the last successful call to next_frame()
+        self.request = 0
+        self.seq = NOT_SEQUENCED
+        self.payload_offset = 0
+        self.payload_bytes = 0
+
+    def pending_bytes(self) -> int:
+        return self.end - self.start
+
+    def recv_from(self, conn: socket.socket) -> int:
+        """Read whatever conn has buffered, returns 0 on EOF."""
+        if self.end == len(self.buffer) or len(self.buffer) - self.start < self.frame_bytes:
+            self._make_room()
+        num_bytes = conn.recv_into(self.view[self.end :])
+        self.end += num_bytes
+        return num_bytes
+
+    def _make_room(self) -> None:
+        pending = self.end - self.start
+        if self.frame_bytes > len(self.buffer):
+            buffer = bytearray(self.frame_bytes)
+            buffer[:pending] = self.view[self.start : self.end]
+            self.view.release()
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif pending > 0:
+            # Only the start of one request, so this copy is small
+            self.buffer[:pending] = bytes(self.view[self.start : self.end])
+        self.start = 0
+        self.end = pending
+
+    def next_frame(self) -> bool:
+        """Decode the next complete request, or return False if there isn't one buffered."""
+        buffer = self.buffer
+        start = self.start
+        available = self.end - start
+        if available == 0:
+            # Everything has been decoded, so the next read can use the whole buffer
+            self.start = self.end = 0
+            self.frame_bytes = 1
+            return False
+
+        request = buffer[start]
+        header_bytes = 1
+        seq = NOT_SEQUENCED
+        if request == ControllerRequest.SEQUENCED:
+            # Sequenced requests carry a sequence number and the actual request, and every response
+            # to them is tagged with the same sequence number
+            header_bytes = SEQUENCED_HEADER_BYTES + 1
+            if available < header_bytes:
+                self.frame_bytes = header_bytes
+                return False
+            seq = buffer[start + 1] | (buffer[start + 2] << 8)
+            request = buffer[start + SEQUENCED_HEADER_BYTES]
+
+        payload_bytes = PAYLOAD_BYTES[request]
+        if payload_bytes is None:
+            raise UnknownRequestError(request, seq)
+
+        frame_bytes = header_bytes + payload_bytes
+        if request == ControllerRequest.UPDATE_REPORT_BATCH and available >= frame_bytes:
+            num_entries = buffer[start + header_bytes] | (buffer[start + header_bytes + 1] << 8)
+            header_bytes = frame_bytes
+            payload_bytes = num_entries * BATCH_ENTRY_BYTES
+            frame_bytes = header_bytes + payload_bytes
+        if available < frame_bytes:
+            self.frame_bytes = frame_bytes
+            return False
+
+        self.request = request
+        self.seq = seq
+        self.payload_offset = start + header_bytes
+        self.payload_bytes = payload_bytes
+        self.start = start + frame_bytes
+        self.frame_bytes = 1
+        return True
@@ -1,20 +1,23 @@
-import collections
 import errno
+import functools
 import getpass
 import inspect
 import logging
-import math
 import signal
-import socket
 import threading
 import time
-from typing import Callable, Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 
 import functionfs
 from functionfs.gadget import ConfigFunctionFFSSubprocess, GadgetSubprocessManager
 
 from . import gamepad_input
-from .commands import ControllerRequest, ControllerResponse
+from .controller_server import (
+    DEFAULT_IDLE_TIMEOUT_S,
+    DEFAULT_LISTEN_ADDRESS,
+    ArbitrationPolicy,
+    ControllerServer,
+)
 from .raw_inputs import (
     EMPTY_REPORT,
     RawButton,
@@ -23,6 +26,8 @@ from .raw_inputs import (
     RawRightStick,
     _RawDPad,
 )
+from .report_scheduler import ReportScheduler
+from .server_stats import DEFAULT_STATS_SOCKET_PATH, ServerStats, stats_socket_path
 
 logger = logging.getLogger(__name__)
 
@@ -94,9 +99,9 @@ class HIDInEndpoint(functionfs.EndpointINFile):
 
     def __init__(self, path, submit, eventfd):
         super().__init__(path, submit, eventfd)
-        self.report_callback: Optional[Callable[..., bytes]] = None
+        self.report_callback: Optional[Callable[[int, bytearray], None]] = None
 
-    def set_report_callback(self, callback: Callable[..., bytes]) -> None:
+    def set_report_callback(self, callback: Callable[[int, bytearray], None]) -> None:
         self.report_callback = callback
 
     def onComplete(self, buffer_list, user_data, status):
@@ -107,9 +112,15 @@ class HIDInEndpoint(functionfs.EndpointINFile):
                 return False
             raise IOError(-status)
 
-        # Resubmit the transfer with a new report.
-        report = self.report_callback() if self.report_callback is not None else EMPTY_REPORT
-        return [bytearray(report)]
+        # Resubmit the transfer with the report that is due now. The host just polled, so this is also when the
+        # poll interval is measured.
+        # The transfer is done with the buffer, so it is refilled in place and resubmitted as is, which avoids
+        # allocating anything per poll.
+        if self.report_callback is not None:
+            self.report_callback(time.monotonic_ns(), buffer_list[0])
+        else:
+            buffer_list[0][:] = EMPTY_REPORT
+        return True
 
 
 class HIDOutEndpoint(functionfs.EndpointOUTFile):
@@ -154,6 +165,10 @@ class UsbHidDevice(functionfs.HIDFunction):
         out_report_max_length=64,
         full_speed_interval=1,
         high_speed_interval=4,
+        listen_address=DEFAULT_LISTEN_ADDRESS,
+        policy=ArbitrationPolicy.EXCLUSIVE,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT_S,
+        stats_socket_path=DEFAULT_STATS_SOCKET_PATH,
     ):
         """
         path, ss_list, os_list, lang_dict, all_ctrl_recip, config0_setup
@@ -217,6 +232,16 @@ class UsbHidDevice(functionfs.HIDFunction):
             14: 1024000
             15: 2048000
             16: 4096000
+        listen_address ((str, int))
+            Address that clients connect to.
+        policy (ArbitrationPolicy)
+            How reports of several clients connected at once are combined.
+        idle_timeout (float)
+            Seconds without a request after which a client loses the
+            exclusive lock to a client that is waiting for it.
+        stats_socket_path (str, None)
+            Unix socket that serves a JSON snapshot of the latency and
+            throughput stats to every connection, or None to not serve them.
         """
         super().__init__(
             path=path,
@@ -238,69 +263,45 @@ class UsbHidDevice(functionfs.HIDFunction):
             high_speed_interval=high_speed_interval,
         )
         self._joystick_lock = threading.RLock()
-        self._user_override_cv = threading.Condition()
         self._gamepad_connected_cv = threading.Condition()
         self.using_gamepad = False
 
         self.gamepad_state = RawButton.Nothing + RawDPad.Center + RawLeftStick.Center + RawRightStick.Center
         self.dpad_state = [0, 0]
 
-        self.report_queue: collections.deque[Tuple[bytes, Optional[int]]] = collections.deque()
-        self.current_report: Tuple[bytes, Optional[int]] = (EMPTY_REPORT, None)
+        self.stats = ServerStats()
+        # Sends the gamepad's reports during a user override, and measures the poll interval for all clients
+        self.scheduler = ReportScheduler(stats=self.stats)
+        self.server = ControllerServer(listen_address, policy, idle_timeout, self.stats)
+        if stats_socket_path is not None:
+            self.stats_thread = self.stats.serve(stats_socket_path)
 
         self.joystick_thread = threading.Thread(target=self.handle_joystick, args=(), daemon=True)
         self.joystick_thread.start()
 
-        self.server_thread = threading.Thread(target=self.listen_on_socket, args=(), daemon=True)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, args=(), daemon=True)
         self.server_thread.start()
         self.enabled = False
 
-    def get_report(self) -> bytes:
-        if self.current_report[1] is None:
-            if len(self.report_queue) == 0:
-                # Current report with infinite repeat and nothing in queue, return report
-                return self.current_report[0]
-            else:
-                # Current report with infinite repeat and something in queue, process queue
-                self.current_report = self.report_queue.popleft()
-                # print(self.current_report)
-        elif self.current_report[1] < 0:
-            if len(self.report_queue) == 0:
-                # Current report with no repeats remaining and nothing in queue, use empty report
-                self.current_report = (EMPTY_REPORT, None)
-                # print(self.current_report)
-            else:
-                # Current report with no repeats remaining and something in queue, process queue
-                self.current_report = self.report_queue.popleft()
-                # print(self.current_report)
-
-        # Process report, decrement by 1 if not infinitely repeating
-        report, times = self.current_report
-        self.current_report = (report, times - 1 if times is not None else times)
-        return report
-
-    def add_report_to_queue(self, report: bytes, num_repeats: Optional[int] = 0) -> None:
-        self.report_queue.append((report, num_repeats))
-
-    @staticmethod
-    def send_response(conn: socket.socket, response_header: ControllerResponse, response_body: bytes = b"") -> int:
-        data = response_header.to_bytes(1, byteorder="little", signed=False) + response_body
-        return conn.send(data)
-
-    @staticmethod
-    def interpret_command(command: bytes) -> Tuple[ControllerRequest, int]:
-        if len(command) != 1:
-            raise ValueError(f"Command should be exactly 1 byte: {command}")
-        request_int = int.from_bytes(command, byteorder="little", signed=False)
-        request = ControllerRequest(request_int)
-
-        # Specify how many more bytes are expected
-        if request == ControllerRequest.UPDATE_REPORT:
-            return request, 8
-        elif request == ControllerRequest.UPDATE_REPORT_FOR_MSEC:
-            return request, 12
+    @property
+    def poll_interval_ms(self) -> float:
+        """The measured interval between IN transfers, i.e. how often the USB host polls for a report."""
+        return self.scheduler.poll_interval_ms
+
+    def get_report(self, now: Optional[int] = None) -> bytes:
+        report = bytearray(EMPTY_REPORT)
+        self.fill_report(report, time.monotonic_ns() if now is None else now)
+        return bytes(report)
+
+    def fill_report(self, buffer: bytearray, now: int) -> None:
+        if self.using_gamepad:
+            self.scheduler.fill_report(buffer, now)
         else:
-            return request, 0
+            self.server.fill_report(buffer, now, self.scheduler.poll_interval_ns)
+
+    def on_poll(self, now: int, buffer: bytearray) -> None:
+        self.scheduler.record_poll(now)
+        self.fill_report(buffer, now)
 
     def handle_joystick(self):
         while True:
@@ -323,12 +324,10 @@ class UsbHidDevice(functionfs.HIDFunction):
         if button == "Home":
             if not is_pressed:
                 with self._joystick_lock:
-                    self.report_queue.clear()
                     self.using_gamepad = not self.using_gamepad
                     print(f"Using gamepad: {self.using_gamepad}")
-                    if not self.using_gamepad:
-                        with self._user_override_cv:
-                            self._user_override_cv.notify()
+                    # Clears every client's queue when the override starts and unblocks the clients when it ends
+                    self.server.set_user_override(self.using_gamepad)
         else:
             if is_pressed:
                 self.gamepad_state |= RawButton[button]
@@ -338,7 +337,7 @@ class UsbHidDevice(functionfs.HIDFunction):
             with self._joystick_lock:
                 if self.using_gamepad:
                     report = self.gamepad_state.to_bytes(8, byteorder="little")
-                    self.current_report = report, None
+                    self.scheduler.hold(report)
 
     def handle_axis_changed(self, axis: str, position: float):
         if axis == "ZL" or axis == "ZR":
@@ -376,73 +375,7 @@ class UsbHidDevice(functionfs.HIDFunction):
         with self._joystick_lock:
             if self.using_gamepad:
                 report = self.gamepad_state.to_bytes(8, byteorder="little")
-                self.current_report = report, None
-
-    def listen_on_socket(self):
-        sock = socket.socket()
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(("0.0.0.0", 3000))
-        sock.listen(1)
-
-        should_stop = False
-        try:
-            while not should_stop:
-                try:
-                    conn, addr = sock.accept()
-                    print(f"Accepting socket connection from {addr}: {conn}")
-                    while not self.enabled:
-                        time.sleep(0.1)
-                    print(f"USB host enabled endpoint, unblocking client")
-                    self.send_response(conn, ControllerResponse.HOST_ENABLED)
-
-                    while True:
-                        command = conn.recv(1)
-                        if not command:
-                            print("Exiting loop because of EOF")
-                            conn.close()
-                            break
-
-                        request, num_bytes_needed = self.interpret_command(command)
-
-                        bytes_recv = 0
-                        msg = b""
-                        while bytes_recv < num_bytes_needed:
-                            msg += conn.recv(num_bytes_needed - bytes_recv)
-                            bytes_recv = len(msg)
-                            if not msg:
-                                conn.close()
-
-                        if (
-                            request == ControllerRequest.UPDATE_REPORT
-                            or request == ControllerRequest.UPDATE_REPORT_FOR_MSEC
-                        ):
-                            self._joystick_lock.acquire()
-                            if self.using_gamepad:
-                                self._joystick_lock.release()
-                                print("Blocking client since user requested direct controller input")
-                                self.send_response(conn, ControllerResponse.USER_OVERRIDE)
-                                with self._user_override_cv:
-                                    while self.using_gamepad:
-                                        self._user_override_cv.wait()
-                                print("Unblocking client since user disabled direct controller input")
-                                self.send_response(conn, ControllerResponse.HOST_ENABLED)
-                            else:
-                                if len(msg) > 8:
-                                    repeat_times = math.ceil(int.from_bytes(msg[8:12], byteorder="little") / 8)
-                                else:
-                                    repeat_times = None
-                                self.add_report_to_queue(msg, repeat_times)
-                                self._joystick_lock.release()
-                                self.send_response(conn, ControllerResponse.ACK)
-                        elif request == ControllerRequest.STOP:
-                            print(f"Stop requested")
-                            should_stop = True
-                            signal.raise_signal(signal.SIGINT)
-                            break
-                except ConnectionResetError:
-                    pass
-        finally:
-            sock.close()
+                self.scheduler.hold(report)
 
     def getEndpointClass(self, is_in, descriptor):
         """
@@ -475,8 +408,9 @@ class UsbHidDevice(functionfs.HIDFunction):
         print("onEnable called")
         super().onEnable()
         self.enabled = True
+        self.server.set_host_enabled(True)
         in_endpoint: HIDInEndpoint = self.getEndpoint(1)
-        in_endpoint.set_report_callback(self.get_report)
+        in_endpoint.set_report_callback(self.on_poll)
         in_endpoint.submit((bytearray(EMPTY_REPORT),))
 
     def setInterfaceDescriptor(self, value, index, length):
@@ -552,22 +486,48 @@ class UsbHidDevice(functionfs.HIDFunction):
         super().setHIDProtocol(value, index, length)
 
 
-_subprocess_manager = None
+_subprocess_managers: Dict[Optional[str], GadgetSubprocessManager] = {}
+# What each UDC's gadget was created with, a UDC can only run one gadget
+_subprocess_manager_args: Dict[Optional[str], Tuple[Tuple[str, int], ArbitrationPolicy, float]] = {}
 _lock = threading.Lock()
 
 
-def subprocess_manager():
+def subprocess_manager(
+    udc: Optional[str] = None,
+    listen_address: Tuple[str, int] = DEFAULT_LISTEN_ADDRESS,
+    policy: ArbitrationPolicy = ArbitrationPolicy.EXCLUSIVE,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT_S,
+):
+    """
+    Gadget on the given UDC (autodetected if None) whose clients connect to listen_address.
+    Every UDC can run one gadget, so one process can drive a console per UDC.
+    """
     with _lock:
-        global _subprocess_manager
-        if _subprocess_manager is None:
-            args = GadgetSubprocessManager.getArgumentParser().parse_args(["--username", getpass.getuser()])
-            _subprocess_manager = GadgetSubprocessManager(
+        manager_args = (listen_address, policy, idle_timeout)
+        if udc in _subprocess_managers and _subprocess_manager_args[udc] != manager_args:
+            raise ValueError(
+                f"The gadget on UDC {udc} already serves {_subprocess_manager_args[udc]}, not {manager_args}"
+            )
+        if udc not in _subprocess_managers:
+            _subprocess_manager_args[udc] = manager_args
+            cli_args = ["--username", getpass.getuser()]
+            if udc is not None:
+                cli_args += ["--udc", udc]
+            args = GadgetSubprocessManager.getArgumentParser().parse_args(cli_args)
+            get_function = functools.partial(
+                UsbHidDevice,
+                listen_address=listen_address,
+                policy=policy,
+                idle_timeout=idle_timeout,
+                stats_socket_path=stats_socket_path(listen_address[1]),
+            )
+            _subprocess_managers[udc] = GadgetSubprocessManager(
                 args=args,
                 config_list=[
                     # A single configuration
                     {
                         "function_list": [
-                            get_config_function_subprocess,
+                            functools.partial(get_config_function_subprocess, get_function),
                         ],
                         "MaxPower": 500,
                         "lang_dict": {
@@ -584,10 +544,22 @@ def subprocess_manager():
                         "manufacturer": "HORI CO.,LTD.",
                     },
                 },
-                name="usbhid",
+                # Gadget names must be unique
+                name="usbhid" if udc is None else f"usbhid_{udc}",
             )
-        return _subprocess_manager
+        return _subprocess_managers[udc]
+
+
+def _get_function_in_subprocess(get_function, **kwargs):
+    # The function subprocess is forked from the gadget process, and an earlier gadget's manager already made that
+    # ignore SIGINT and handle SIGCHLD for its own functions. Without this, kill() couldn't stop the function and
+    # join() would wait for it forever.
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    return get_function(**kwargs)
 
 
-def get_config_function_subprocess(**kwargs):
-    return ConfigFunctionFFSSubprocess(getFunction=UsbHidDevice, **kwargs)
+def get_config_function_subprocess(get_function=UsbHidDevice, **kwargs):
+    return ConfigFunctionFFSSubprocess(
+        getFunction=functools.partial(_get_function_in_subprocess, get_function), **kwargs
+    )
@@ -0,0 +1,96 @@
+import time
+from array import array
+from typing import Iterable, Optional, Tuple
+
+from .commands import MAX_BATCH_ENTRIES, REPORT_BYTES
+
+# Stored in place of a duration for reports that are held until the next one is queued
+HOLD = -1
+# Returned by pop_into() when clear() emptied the ring after the consumer checked that it wasn't empty
+EMPTY = -2
+
+# Large enough that a full UPDATE_REPORT_BATCH always fits once the ring has drained
+DEFAULT_CAPACITY = MAX_BATCH_ENTRIES + 1
+
+
+class ReportRing:
+    """
+    Fixed capacity single-producer/single-consumer queue of 8 byte reports and their durations.
+
+    All storage is allocated up front. The producer only ever advances the tail and the consumer only ever
+    advances the head, and each side publishes its index with a single assignment after the slot has been
+    written or read, so the two sides need no lock between them. A batch of reports is published with one
+    tail update, so the consumer sees either all of it or none of it.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._reports = bytearray(capacity * REPORT_BYTES)
+        view = memoryview(self._reports)
+        # Slicing a memoryview allocates, so keep one view per slot around
+        self._slots = [view[i * REPORT_BYTES : (i + 1) * REPORT_BYTES] for i in range(capacity)]
+        self._durations = array("q", [HOLD]) * capacity
+        # Monotonic time each report was queued at, to measure how long reports wait
+        self._queued_at = array("q", [0]) * capacity
+        # Queue time of the report most recently returned by pop_into()
+        self.last_queued_at = 0
+        # Both indexes grow forever, the slot is the index modulo capacity
+        self._head = 0
+        self._tail = 0
+        # Set by clear() from any thread and applied by the consumer
+        self._discard_until = 0
+
+    def __len__(self) -> int:
+        return self._tail - max(self._head, self._discard_until)
+
+    def free(self) -> int:
+        # Discarded slots are free even before the consumer has skipped them
+        return self.capacity - (self._tail - max(self._head, self._discard_until))
+
+    def push(self, report: bytes, duration_ns: Optional[int] = None) -> bool:
+        if self.free() < 1:
+            return False
+        self._write(self._tail, report, duration_ns, time.monotonic_ns())
+        self._tail += 1
+        return True
+
+    def extend(self, reports: Iterable[Tuple[bytes, Optional[int]]]) -> bool:
+        reports = list(reports)
+        if self.free() < len(reports):
+            return False
+        tail = self._tail
+        queued_at = time.monotonic_ns()
+        for report, duration_ns in reports:
+            self._write(tail, report, duration_ns, queued_at)
+            tail += 1
+        self._tail = tail
+        return True
+
+    def _write(self, index: int, report: bytes, duration_ns: Optional[int], queued_at: int) -> None:
+        slot = index % self.capacity
+        self._slots[slot][:] = report
+        self._durations[slot] = HOLD if duration_ns is None else duration_ns
+        self._queued_at[slot] = queued_at
+
+    def clear(self) -> int:
+        """Discard everything that is queued and return roughly how many reports that was."""
+        discarded = len(self)
+        self._discard_until = self._tail
+        return max(discarded, 0)
+
+    def pop_into(self, buffer: bytearray) -> Optional[int]:
+        """
+        Copy the oldest report into buffer and return its duration in nanoseconds (None if it is held).
+        clear() can run on another thread after the caller checked that the ring isn't empty, so this returns
+        EMPTY and leaves buffer alone if there is nothing left to pop.
+        """
+        head = max(self._head, self._discard_until)
+        if head >= self._tail:
+            self._head = head
+            return EMPTY
+        slot = head % self.capacity
+        buffer[:] = self._slots[slot]
+        duration_ns = self._durations[slot]
+        self.last_queued_at = self._queued_at[slot]
+        self._head = head + 1
+        return None if duration_ns == HOLD else duration_ns
@@ -0,0 +1,128 @@
+import time
+from typing import Iterable, Optional, Tuple
+
+from .raw_inputs import EMPTY_REPORT
+from .report_ring import DEFAULT_CAPACITY, EMPTY, ReportRing
+from .server_stats import ServerStats
+
+NSEC_PER_MSEC = 1_000_000
+
+# Assumed until the host has polled a few times. This is the interval most hosts end up using for the HORIPAD.
+DEFAULT_POLL_INTERVAL_NS = 8 * NSEC_PER_MSEC
+# Weight of a new sample in the poll interval moving average
+POLL_INTERVAL_SMOOTHING = 1 / 16
+# Gaps longer than this are suspends or stalls, not polls
+MAX_POLL_INTERVAL_NS = 1000 * NSEC_PER_MSEC
+
+# (report, duration in nanoseconds or None to hold the report until the next one is queued)
+ScheduledReport = Tuple[bytes, Optional[int]]
+
+
+def duration_ns_for_msec(duration_ms: int) -> int:
+    return duration_ms * NSEC_PER_MSEC
+
+
+class ReportScheduler:
+    """
+    Chooses the report to send to the USB host from the current time instead of counting polls.
+
+    A queued report gets an absolute monotonic deadline when it starts being sent. The next report starts at
+    that deadline rather than at the poll where the switch was noticed, so rounding to the poll interval does not
+    accumulate over a long sequence of inputs. If the host stopped polling for a while, the next report starts
+    at the current time instead, so that it isn't cut short to catch up.
+
+    Reports are queued in a preallocated ReportRing and the current report lives in a preallocated buffer, so
+    choosing the next report doesn't allocate on the USB completion path.
+
+    If stats are given, poll intervals, queueing delays and late or dropped reports are recorded in them.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, stats: Optional[ServerStats] = None):
+        self.queue = ReportRing(capacity)
+        self.stats = stats
+        self.current_report = bytearray(EMPTY_REPORT)
+        # None when the current report is held until something else is queued
+        self.current_deadline: Optional[int] = None
+
+        self.poll_interval_ns: float = DEFAULT_POLL_INTERVAL_NS
+        self.last_poll_ns: Optional[int] = None
+
+    @property
+    def poll_interval_ms(self) -> float:
+        return self.poll_interval_ns / NSEC_PER_MSEC
+
+    def record_poll(self, now: int) -> None:
+        if self.last_poll_ns is not None:
+            interval = now - self.last_poll_ns
+            if 0 < interval < MAX_POLL_INTERVAL_NS:
+                self.poll_interval_ns += (interval - self.poll_interval_ns) * POLL_INTERVAL_SMOOTHING
+            if self.stats is not None:
+                self.stats.poll_interval_us.record(interval // 1000)
+        self.last_poll_ns = now
+
+    def add_report(self, report: bytes, duration_ns: Optional[int] = None) -> bool:
+        return self.queue.push(report, duration_ns)
+
+    def add_reports(self, reports: Iterable[ScheduledReport]) -> bool:
+        """Queue all of the reports at once, or none of them if the queue doesn't have room."""
+        return self.queue.extend(reports)
+
+    def has_room_for(self, num_reports: int) -> bool:
+        return self.queue.free() >= num_reports
+
+    def hold(self, report: bytes) -> None:
+        self.current_report[:] = report
+        self.current_deadline = None
+
+    def clear(self) -> None:
+        dropped = self.queue.clear()
+        if self.stats is not None:
+            self.stats.dropped_reports.increment(dropped)
+
+    def get_report(self, now: Optional[int] = None) -> bytes:
+        report = bytearray(len(self.current_report))
+        self.fill_report(report, now)
+        return bytes(report)
+
+    def fill_report(self, buffer: bytearray, now: Optional[int] = None) -> None:
+        """Copy the report that is due at now into buffer."""
+        if now is None:
+            now = time.monotonic_ns()
+
+        if self.current_deadline is None:
+            if len(self.queue) == 0:
+                # Current report is held and nothing in queue, keep sending it
+                buffer[:] = self.current_report
+                return
+            start = now
+        else:
+            # Switch at whichever poll is closest to the deadline, rather than the first one after it
+            if now + self.poll_interval_ns / 2 < self.current_deadline:
+                buffer[:] = self.current_report
+                return
+            if len(self.queue) == 0:
+                # Current report expired and nothing in queue, use empty report
+                self.current_report[:] = EMPTY_REPORT
+                self.current_deadline = None
+                buffer[:] = self.current_report
+                return
+            start = self.current_deadline
+            if now - start > self.poll_interval_ns:
+                # Polls stalled past the deadline, don't shorten this report to catch up
+                start = now
+                if self.stats is not None:
+                    self.stats.late_reports.increment()
+
+        duration_ns = self.queue.pop_into(self.current_report)
+        if duration_ns == EMPTY:
+            # Cleared since the length check, same as finding the queue empty
+            if self.current_deadline is not None:
+                self.current_report[:] = EMPTY_REPORT
+                self.current_deadline = None
+            buffer[:] = self.current_report
+            return
+        if self.stats is not None:
+            self.stats.reports_sent.increment()
+            self.stats.queue_to_usb_us.record((now - self.queue.last_queued_at) // 1000)
+        self.current_deadline = start + duration_ns if duration_ns is not None else None
+        buffer[:] = self.current_report
@@ -0,0 +1,180 @@
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+def stats_socket_path(port: int) -> str:
+    """Stats socket of the gadget whose clients connect to the given port."""
+    return f"/tmp/nx-controller-stats-{port}.sock"
+
+
+DEFAULT_STATS_SOCKET_PATH = stats_socket_path(3000)
+
+# Enough power of two buckets for anything up to about 35 minutes in microseconds
+NUM_BUCKETS = 32
+
+
+class Counter:
+    """A count that is only incremented from one thread, so there is no locking."""
+
+    def __init__(self):
+        self.value = 0
+
+    def increment(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class LockedCounter(Counter):
+    """A count that is incremented from several threads."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def increment(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    Distribution of non-negative integer samples in power of two buckets.
+    Recording a sample is a few integer operations, so it is cheap enough for the USB completion path.
+    Every histogram is only recorded to from one thread, so there is no locking.
+    """
+
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def record(self, value: int) -> None:
+        if value < 0:
+            value = 0
+        self.buckets[min(value.bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _percentile(self, buckets: List[int], count: int, fraction: float) -> Optional[int]:
+        """Upper bound of the bucket that the given fraction of samples falls into."""
+        if count == 0:
+            return None
+        threshold = count * fraction
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            if seen >= threshold:
+                return (1 << index) - 1 if index > 0 else 0
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = list(self.buckets)
+        count = sum(buckets)
+        return {
+            "unit": self.unit,
+            "count": count,
+            "mean": self.total / count if count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self._percentile(buckets, count, 0.5),
+            "p99": self._percentile(buckets, count, 0.99),
+            # Keyed on the largest value that falls into each bucket
+            "buckets": {str((1 << index) - 1 if index > 0 else 0): n for index, n in enumerate(buckets) if n},
+        }
+
+
+class ServerStats:
+    """
+    Counters and histograms for where time goes between a client sending a report and the USB host reading it.
+    Each is only updated from one thread, either the server thread or the USB thread, except for dropped_reports,
+    which the joystick thread also updates on a user override.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+
+        # From a request being fully received to its reports being queued, including backpressure and overrides
+        self.recv_to_queue_us = Histogram("us")
+        # From a report being queued to it first being handed to the USB host
+        self.queue_to_usb_us = Histogram("us")
+        # Time between IN transfer completions, i.e. the real polling interval of the host
+        self.poll_interval_us = Histogram("us")
+        # Reports waiting in the queue right after a request was queued
+        self.queue_depth = Histogram("reports")
+        # How long requests were held by a user override or by another client's exclusive lock
+        self.user_override_us = Histogram("us")
+
+        self.requests_received = Counter()
+        self.reports_queued = Counter()
+        self.reports_sent = Counter()
+        # Reports that started more than a poll late because the host stopped polling
+        self.late_reports = Counter()
+        # Reports that were discarded from the queue before being sent, e.g. by a user override
+        self.dropped_reports = LockedCounter()
+
+    def snapshot(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"uptime_s": time.time() - self.started_at}
+        for name, value in vars(self).items():
+            if isinstance(value, (Counter, Histogram)):
+                result[name] = value.snapshot()
+        return result
+
+    def serve(self, path: str = DEFAULT_STATS_SOCKET_PATH) -> threading.Thread:
+        """
+        Serve a JSON snapshot to every connection on a Unix socket, e.g.
+            socat - UNIX-CONNECT:/tmp/nx-controller-stats-3000.sock
+        """
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(1)
+
+        def serve_forever():
+            try:
+                while True:
+                    try:
+                        conn, _ = sock.accept()
+                    except OSError:
+                        # E.g. out of file descriptors, try again rather than stop serving stats for good
+                        time.sleep(0.1)
+                        continue
+                    with conn:
+                        try:
+                            conn.sendall(json.dumps(self.snapshot()).encode("utf-8"))
+                        except OSError:
+                            # The client went away before reading everything
+                            pass
+            finally:
+                sock.close()
+
+        thread = threading.Thread(target=serve_forever, args=(), daemon=True)
+        thread.start()
+        return thread
+
+
+def fetch_server_stats(path: str = DEFAULT_STATS_SOCKET_PATH) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.decode("utf-8"))
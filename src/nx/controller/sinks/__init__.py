@@ -1,3 +1,4 @@
+from .async_socket_sink import AsyncSocketSink
 from .controller_sink import ControllerSink
 from .socket_sink import SocketSink
 from .windows_named_pipe_sink import WindowsNamedPipeSink
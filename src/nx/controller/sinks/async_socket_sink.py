@@ -0,0 +1,185 @@
+import asyncio
+import ipaddress
+import socket
+from typing import Dict, Optional
+
+from ..commands import (
+    SEQUENCE_NUMBER_BYTES,
+    SEQUENCE_NUMBER_MASK,
+    ControllerRequest,
+    ControllerResponse,
+)
+
+
+class AsyncSocketSink:
+    """
+    asyncio stream based equivalent of SocketSink, for use with AsyncController:
+
+        async with AsyncSocketSink("raspberrypi", 3000) as sink:
+            controller = AsyncController(sink)
+            await controller.press_button(Button.A)
+    """
+
+    def __init__(self, ip_or_host: str, port: int, pipelined: bool = False, max_in_flight: int = 32):
+        try:
+            ipaddress.ip_address(ip_or_host)
+        except ValueError:
+            ip_or_host = socket.gethostbyname(ip_or_host)
+
+        self.ip = ip_or_host
+        self.port = port
+        self.pipelined = pipelined
+        self.max_in_flight = max_in_flight
+        self.wrapper: Optional[AsyncSocketWrapper] = None
+
+    async def connect(self) -> "AsyncSocketWrapper":
+        print(f"Connecting to {self.ip}:{self.port}")
+        reader, writer = await asyncio.open_connection(self.ip, self.port)
+        print(f"Connected to {self.ip}:{self.port}")
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # wait for connection
+        msg = ControllerResponse.from_bytes(await reader.readexactly(1), byteorder="little")
+        if msg != ControllerResponse.HOST_ENABLED:
+            writer.close()
+            raise ValueError(f"Unexpected response from server: {msg}")
+        print("Connected to controller host")
+
+        if self.pipelined:
+            self.wrapper = AsyncPipelinedSocketWrapper(reader, writer, self.max_in_flight)
+        else:
+            self.wrapper = AsyncSocketWrapper(reader, writer)
+        return self.wrapper
+
+    async def close(self):
+        if self.wrapper is not None:
+            await self.wrapper.close()
+            self.wrapper = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.wrapper is not None and exc_type is None:
+            await self.wrapper.flush()
+        await self.close()
+
+
+class AsyncSocketWrapper:
+    supports_batch = True
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # Requests and their responses must not interleave when several tasks share a controller
+        self._lock = asyncio.Lock()
+
+    async def _read_response(self) -> ControllerResponse:
+        try:
+            return ControllerResponse.from_bytes(await self.reader.readexactly(1), byteorder="little")
+        except asyncio.IncompleteReadError as e:
+            raise RuntimeError("Socket closed unexpectedly") from e
+
+    async def write(self, command: ControllerRequest, data: bytes):
+        frame = command.serialize() + data
+        async with self._lock:
+            self.writer.write(frame)
+            await self.writer.drain()
+            while True:
+                msg = await self._read_response()
+                if msg == ControllerResponse.USER_OVERRIDE:
+                    print("User override, waiting for server to unblock")
+                    msg = await self._read_response()
+                    if msg != ControllerResponse.HOST_ENABLED:
+                        raise ValueError(f"Unexpected response from server: {msg}")
+                    print("Unblocked, retrying")
+                    self.writer.write(frame)
+                    await self.writer.drain()
+                elif msg != ControllerResponse.ACK:
+                    raise ValueError(f"Unexpected response from server: {msg}")
+                else:
+                    return len(frame)
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class AsyncPipelinedSocketWrapper(AsyncSocketWrapper):
+    """
+    asyncio equivalent of PipelinedSocketWrapper. write() returns as soon as the request has been handed to the
+    transport, and a reader task matches the tagged responses to the requests in flight.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_in_flight: int = 32):
+        super().__init__(reader, writer)
+        self.max_in_flight = max_in_flight
+        self._next_seq = 0
+        self._pending: Dict[int, ControllerRequest] = {}
+        self._pending_cv = asyncio.Condition()
+        self._error: Optional[BaseException] = None
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_responses())
+
+    async def _read_responses(self):
+        try:
+            while True:
+                try:
+                    response = await self.reader.readexactly(1 + SEQUENCE_NUMBER_BYTES)
+                except asyncio.IncompleteReadError as e:
+                    raise RuntimeError("Socket closed unexpectedly") from e
+                msg = ControllerResponse.from_bytes(response[:1], byteorder="little")
+                seq = int.from_bytes(response[1:], byteorder="little")
+                if msg == ControllerResponse.ACK:
+                    async with self._pending_cv:
+                        self._pending.pop(seq, None)
+                        self._pending_cv.notify_all()
+                elif msg == ControllerResponse.USER_OVERRIDE:
+                    print(f"User override, server is holding request {seq}")
+                elif msg == ControllerResponse.HOST_ENABLED:
+                    print(f"Unblocked, server is resuming from request {seq}")
+                else:
+                    request = self._pending.get(seq)
+                    raise ValueError(f"Unexpected response from server for {request!r} (seq {seq}): {msg}")
+        except (OSError, RuntimeError, ValueError) as e:
+            async with self._pending_cv:
+                self._error = e
+                self._pending_cv.notify_all()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("Controller connection failed") from self._error
+
+    async def write(self, command: ControllerRequest, data: bytes):
+        async with self._pending_cv:
+            await self._pending_cv.wait_for(lambda: self._error is not None or len(self._pending) < self.max_in_flight)
+            self._raise_if_failed()
+            seq = self._next_seq
+            self._next_seq = (seq + 1) & SEQUENCE_NUMBER_MASK
+            # The server closes the connection on STOP without ACKing it, so nothing would ever take it off again
+            if command != ControllerRequest.STOP:
+                self._pending[seq] = command
+
+        frame = (
+            ControllerRequest.SEQUENCED.serialize()
+            + seq.to_bytes(SEQUENCE_NUMBER_BYTES, byteorder="little")
+            + command.serialize()
+            + data
+        )
+        self.writer.write(frame)
+        await self.writer.drain()
+        return len(frame)
+
+    async def flush(self):
+        # Wait until the server has acknowledged everything that is in flight
+        async with self._pending_cv:
+            await self._pending_cv.wait_for(lambda: self._error is not None or len(self._pending) == 0)
+            # The connection closing after everything was ACKed, e.g. after a STOP, loses nothing
+            if self._pending:
+                self._raise_if_failed()
+
+    async def close(self):
+        self._reader_task.cancel()
+        await super().close()
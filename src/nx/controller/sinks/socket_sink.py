@@ -1,8 +1,15 @@
 import asyncio
 import ipaddress
 import socket
+import threading
+from typing import Dict, Optional
 
-from ..commands import ControllerRequest, ControllerResponse
+from ..commands import (
+    SEQUENCE_NUMBER_BYTES,
+    SEQUENCE_NUMBER_MASK,
+    ControllerRequest,
+    ControllerResponse,
+)
 from . import ControllerSink
 
 
@@ -11,15 +18,18 @@ class SocketSink(ControllerSink):
     def get_ip_from_hostname(hostname: str) -> str:
         return socket.gethostbyname(hostname)
 
-    def __init__(self, ip_or_host: str, port: int):
+    def __init__(self, ip_or_host: str, port: int, pipelined: bool = False, max_in_flight: int = 32):
         try:
             ipaddress.ip_address(ip_or_host)
         except ValueError:
             ip_or_host = self.get_ip_from_hostname(ip_or_host)
 
         self.sock = None
+        self.wrapper: Optional[SocketWrapper] = None
         self.ip = ip_or_host
         self.port = port
+        self.pipelined = pipelined
+        self.max_in_flight = max_in_flight
 
     async def connect(self):
         loop = asyncio.get_running_loop()
@@ -38,18 +48,34 @@ class SocketSink(ControllerSink):
             else:
                 raise ValueError(f"Unexpected response from server: {msg}")
 
-        return SocketWrapper(self.sock)
+        if self.pipelined:
+            # Don't let Nagle's algorithm hold back small frames while waiting for ACKs
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.wrapper = PipelinedSocketWrapper(self.sock, self.max_in_flight)
+        else:
+            self.wrapper = SocketWrapper(self.sock)
+        return self.wrapper
 
     def __enter__(self):
         return asyncio.run(self.connect())
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.wrapper is not None and exc_type is None:
+            self.wrapper.flush()
+        self.wrapper = None
         if self.sock is not None:
+            try:
+                # Wakes up the pipelined reader thread, which would otherwise keep the connection open
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.sock.close()
             self.sock = None
 
 
 class SocketWrapper:
+    supports_batch = True
+
     def __init__(self, sock):
         self.sock = sock
 
@@ -76,3 +102,85 @@ class SocketWrapper:
 
     def flush(self):
         pass
+
+
+class PipelinedSocketWrapper(SocketWrapper):
+    """
+    Sends every request wrapped in a SEQUENCED frame without waiting for its response, so that up to
+    max_in_flight requests can be queued on the server at once. A background thread matches the tagged
+    responses to their requests. During a user override the server holds on to the request and ACKs it
+    once it has been queued, so nothing needs to be retransmitted and ordering is preserved.
+    """
+
+    def __init__(self, sock, max_in_flight: int = 32):
+        super().__init__(sock)
+        self.max_in_flight = max_in_flight
+        self._next_seq = 0
+        self._pending: Dict[int, ControllerRequest] = {}
+        self._pending_cv = threading.Condition()
+        self._error: Optional[BaseException] = None
+        self._reader_thread = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader_thread.start()
+
+    def _recv_exactly(self, num_bytes: int) -> bytes:
+        msg = b""
+        while len(msg) < num_bytes:
+            chunk = self.sock.recv(num_bytes - len(msg))
+            if not chunk:
+                raise RuntimeError("Socket closed unexpectedly")
+            msg += chunk
+        return msg
+
+    def _read_responses(self):
+        try:
+            while True:
+                response = self._recv_exactly(1 + SEQUENCE_NUMBER_BYTES)
+                msg = ControllerResponse.from_bytes(response[:1], byteorder="little")
+                seq = int.from_bytes(response[1:], byteorder="little")
+                if msg == ControllerResponse.ACK:
+                    with self._pending_cv:
+                        self._pending.pop(seq, None)
+                        self._pending_cv.notify_all()
+                elif msg == ControllerResponse.USER_OVERRIDE:
+                    print(f"User override, server is holding request {seq}")
+                elif msg == ControllerResponse.HOST_ENABLED:
+                    print(f"Unblocked, server is resuming from request {seq}")
+                else:
+                    with self._pending_cv:
+                        request = self._pending.get(seq)
+                    raise ValueError(f"Unexpected response from server for {request!r} (seq {seq}): {msg}")
+        except (OSError, RuntimeError, ValueError) as e:
+            with self._pending_cv:
+                self._error = e
+                self._pending_cv.notify_all()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("Controller connection failed") from self._error
+
+    def write(self, command: ControllerRequest, data: bytes):
+        with self._pending_cv:
+            self._pending_cv.wait_for(lambda: self._error is not None or len(self._pending) < self.max_in_flight)
+            self._raise_if_failed()
+            seq = self._next_seq
+            self._next_seq = (seq + 1) & SEQUENCE_NUMBER_MASK
+            # The server closes the connection on STOP without ACKing it, so nothing would ever take it off again
+            if command != ControllerRequest.STOP:
+                self._pending[seq] = command
+
+        frame = (
+            ControllerRequest.SEQUENCED.serialize()
+            + seq.to_bytes(SEQUENCE_NUMBER_BYTES, byteorder="little")
+            + command.serialize()
+            + data
+        )
+        self.sock.sendall(frame)
+        return len(frame)
+
+    def flush(self):
+        # Block until the server has acknowledged everything that is in flight
+        with self._pending_cv:
+            self._pending_cv.wait_for(lambda: self._error is not None or len(self._pending) == 0)
+            # The connection closing after everything was ACKed, e.g. after a STOP, loses nothing
+            if self._pending:
+                self._raise_if_failed()
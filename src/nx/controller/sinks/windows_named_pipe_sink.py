@@ -10,6 +10,9 @@ from nx.controller.commands import ControllerRequest, ControllerResponse
 
 
 class PipeWrapper:
+    # The report injector only understands single report updates
+    supports_batch = False
+
     def __init__(self, process_id: int, pipe_handle: int):
         self.process_id = process_id
         self.pipe_handle = pipe_handle
@@ -0,0 +1,53 @@
+import argparse
+import time
+
+from nx.automation import image_processing
+from nx.automation.frame_bus import (
+    DEFAULT_FRAME_BUS_NAME,
+    DEFAULT_NUM_SLOTS,
+    FrameBusWriter,
+)
+from nx.automation.frame_grabber import RETRY_INTERVAL_S
+
+
+def run_capture_daemon():
+    parser = argparse.ArgumentParser(
+        description="Read the capture device and publish its frames to every script on this machine"
+    )
+    parser.add_argument("--name", default=DEFAULT_FRAME_BUS_NAME, help="Name of the shared memory")
+    parser.add_argument("--slots", type=int, default=DEFAULT_NUM_SLOTS, help="Number of frames kept in the ring")
+    args = parser.parse_args()
+
+    writer = None
+    try:
+        while True:
+            # Read the device directly, this process must not become a reader of its own bus
+            try:
+                frame = image_processing.capture_linux()
+                if frame is None:
+                    raise RuntimeError("Capture device returned no frame")
+            except Exception as e:
+                # Readers keep the last frame meanwhile, which beats the bus going away altogether
+                print(f"Failed to read frame: {e!r}")
+                time.sleep(RETRY_INTERVAL_S)
+                continue
+            if writer is None or writer.shape != frame.shape:
+                first_seq = 1
+                if writer is not None:
+                    print(f"Resolution changed to {frame.shape[1]}x{frame.shape[0]}, recreating {args.name}")
+                    first_seq = writer.seq + 1
+                    writer.close()
+                writer = FrameBusWriter(
+                    frame.shape, args.name, args.slots, first_seq, image_processing.LINUX_CAPTURE_BGR2RGB
+                )
+                print(f"Publishing {frame.shape[1]}x{frame.shape[0]} frames to {args.name}")
+            writer.publish(frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    run_capture_daemon()
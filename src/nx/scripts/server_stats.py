@@ -0,0 +1,20 @@
+import json
+import sys
+
+from nx.controller.server_stats import (
+    DEFAULT_STATS_SOCKET_PATH,
+    fetch_server_stats,
+    stats_socket_path,
+)
+
+
+def print_server_stats():
+    # Either the path of the stats socket or the port of the gadget
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STATS_SOCKET_PATH
+    if path.isdigit():
+        path = stats_socket_path(int(path))
+    print(json.dumps(fetch_server_stats(path), indent=2))
+
+
+if __name__ == "__main__":
+    print_server_stats()
@@ -1,9 +1,74 @@
+import argparse
+import contextlib
+import signal
+
+from nx.controller.controller_server import (
+    DEFAULT_IDLE_TIMEOUT_S,
+    DEFAULT_LISTEN_ADDRESS,
+    ArbitrationPolicy,
+)
 from nx.controller.function_fs_server import subprocess_manager
 
 
+def parse_gadget(value: str):
+    # [UDC:]PORT, the UDC is autodetected if it is left out
+    udc, _, port = value.rpartition(":")
+    return udc or None, int(port)
+
+
+def wait_for_any(managers) -> None:
+    """
+    Wait until the gadget function of any of the managers exits. Every manager installs a SIGCHLD handler that only
+    checks its own function, each replacing the previous one, so one handler checks them all instead.
+    """
+
+    def on_child_exit(signal_number, stack_frame):
+        # Each manager has a single configuration with a single function
+        if any(manager.getFunction(0, 0).getExitStatus() is not None for manager in managers):
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            # Like the managers' own handler, their __exit__ suppresses it after tearing down the gadget
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGCHLD, on_child_exit)
+    # A function may have exited before the handler was in place
+    on_child_exit(signal.SIGCHLD, None)
+    while True:
+        signal.pause()
+
+
 def start_server():
-    with subprocess_manager() as gadget:
-        gadget.waitForever()
+    parser = argparse.ArgumentParser(description="Emulate a HORIPAD S on every given USB device controller")
+    parser.add_argument(
+        "--gadget",
+        action="append",
+        type=parse_gadget,
+        metavar="[UDC:]PORT",
+        help=f"Run a gadget on UDC that clients connect to on PORT, can be given once per UDC "
+        f"(default: autodetected UDC on port {DEFAULT_LISTEN_ADDRESS[1]})",
+    )
+    parser.add_argument("--host", default=DEFAULT_LISTEN_ADDRESS[0], help="Address to listen on")
+    parser.add_argument(
+        "--policy",
+        type=ArbitrationPolicy,
+        choices=list(ArbitrationPolicy),
+        default=ArbitrationPolicy.EXCLUSIVE,
+        help="How to combine the inputs of several clients connected to the same gadget",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT_S,
+        help="Seconds without a request after which a client loses the exclusive lock",
+    )
+    args = parser.parse_args()
+
+    gadgets = args.gadget or [(None, DEFAULT_LISTEN_ADDRESS[1])]
+    with contextlib.ExitStack() as stack:
+        managers = [
+            stack.enter_context(subprocess_manager(udc, (args.host, port), args.policy, args.idle_timeout))
+            for udc, port in gadgets
+        ]
+        wait_for_any(managers)
 
 
 if __name__ == "__main__":
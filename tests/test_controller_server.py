@@ -0,0 +1,40 @@
+import socket
+import time
+
+from nx.controller.controller_server import ClientConnection, ControllerServer
+from nx.controller.report_scheduler import duration_ns_for_msec
+
+REPORT = bytes(range(1, 9))
+
+
+def make_client(server: ControllerServer) -> ClientConnection:
+    conn, _ = socket.socketpair()
+    return ClientConnection(conn, conn.getsockname(), server.stats)
+
+
+def test_owner_playing_a_long_batch_keeps_control_past_idle_timeout():
+    server = ControllerServer(idle_timeout=1.0)
+    owner = make_client(server)
+    other = make_client(server)
+    assert server._has_control(owner)
+
+    # A minute long batch, uploaded long enough ago that the owner sent nothing within idle_timeout
+    assert owner.scheduler.add_reports([(REPORT, duration_ns_for_msec(1000))] * 60)
+    owner.scheduler.get_report()
+    owner.last_active = time.monotonic() - 10 * server.idle_timeout
+
+    assert not server._has_control(other)
+    assert server.owner is owner
+    assert len(owner.scheduler.queue) == 59
+    assert owner.scheduler.current_deadline is not None
+
+
+def test_drained_idle_owner_loses_control():
+    server = ControllerServer(idle_timeout=1.0)
+    owner = make_client(server)
+    other = make_client(server)
+    assert server._has_control(owner)
+    owner.last_active = time.monotonic() - 10 * server.idle_timeout
+
+    assert server._has_control(other)
+    assert server.owner is other
@@ -0,0 +1,53 @@
+from nx.controller.raw_inputs import EMPTY_REPORT
+from nx.controller.report_ring import EMPTY, ReportRing
+from nx.controller.report_scheduler import ReportScheduler
+
+REPORT = bytes(range(1, 9))
+
+
+def test_clear_between_length_check_and_pop():
+    ring = ReportRing(capacity=4)
+    for _ in range(3):
+        assert ring.push(REPORT, 1_000_000)
+    assert len(ring) == 3
+
+    # Another thread clears the ring after the consumer saw that it wasn't empty
+    ring.clear()
+    buffer = bytearray(EMPTY_REPORT)
+    assert ring.pop_into(buffer) == EMPTY
+    assert buffer == EMPTY_REPORT
+    assert len(ring) == 0
+    assert ring.free() == ring.capacity
+
+    # The ring keeps working after the discarded reports are skipped
+    assert ring.push(REPORT, None)
+    assert ring.pop_into(buffer) is None
+    assert buffer == REPORT
+    assert len(ring) == 0
+    assert ring.free() == ring.capacity
+
+
+def test_free_counts_discarded_slots_before_they_are_skipped():
+    ring = ReportRing(capacity=4)
+    for _ in range(4):
+        assert ring.push(REPORT, 1_000_000)
+    assert ring.free() == 0
+    ring.clear()
+    assert ring.free() == ring.capacity
+    assert len(ring) == 0
+
+
+def test_scheduler_handles_ring_cleared_after_length_check(monkeypatch):
+    scheduler = ReportScheduler()
+    scheduler.queue.push(REPORT, None)
+    pop_into = scheduler.queue.pop_into
+
+    def clear_then_pop(buffer):
+        scheduler.queue.clear()
+        return pop_into(buffer)
+
+    monkeypatch.setattr(scheduler.queue, "pop_into", clear_then_pop)
+    buffer = bytearray(len(EMPTY_REPORT))
+    scheduler.fill_report(buffer, now=0)
+    assert buffer == EMPTY_REPORT
+    assert scheduler.current_deadline is None